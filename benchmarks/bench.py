@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the esix library.
+
+Every benchmark runs against the local fake server in `esix.fakeserver`, so
+no requests are made to the real site. Results are written as JSON and can
+be compared against a previous run to spot regressions:
+
+    python benchmarks/bench.py --save results/base.json
+    python benchmarks/bench.py --compare results/base.json
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'examples'))
+
+import esix
+from esix import fakeserver
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """Register a benchmark. Benchmarks return a dict of metric name to
+    (value, unit, higher_is_better)."""
+    BENCHMARKS.append(func)
+    return func
+
+def timed(func, repeat=5):
+    """Run a function several times.
+
+    :returns: The best wall time in seconds, and the last return value.
+    :rtype: tuple
+    """
+    best, result = None, None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best: best = elapsed
+    return best, result
+
+
+@benchmark
+def search_pages(args):
+    """Pages per second for `post.search`, in-process and over HTTP."""
+    server = fakeserver.FakeServer.generate(num_posts=args.posts,
+                                            seed=args.seed)
+    results = {}
+    for mode in ('inprocess', 'http'):
+        if mode == 'http': server.start()
+        with server:
+            def run():
+                server.reset_hits()
+                for p in esix.post.search('', 0): pass
+                return server.hits.get('post/index.json', 0)
+            elapsed, pages = timed(run, args.repeat)
+        results['search_pages_per_sec_' + mode] = (pages / elapsed,
+                                                   'pages/s', True)
+    server.stop()
+    return results
+
+@benchmark
+def json_decode(args):
+    """Decode time per 320-post page for each installed JSON backend,
+    against decoding the text as the library used to."""
+    server = fakeserver.FakeServer.generate(num_posts=320, seed=args.seed,
+                                            description_size=2000)
+    page = server.handle('GET', server.base_url +
+                         'post/index.json?limit=320')
+    results = {}
+    elapsed, _ = timed(lambda: json.loads(page.text), args.repeat)
+    results['json_decode_ms_per_page_text'] = (elapsed * 1000, 'ms', False)
+    old = esix.api.get_json_backend()
+    try:
+        for name in esix.api.JSON_BACKENDS:
+            try: esix.api.set_json_backend(name)
+            except ValueError: continue
+            elapsed, _ = timed(lambda: esix.api._get_data_obj(page),
+                               args.repeat)
+            results['json_decode_ms_per_page_' + name] = (elapsed * 1000,
+                                                          'ms', False)
+    finally:
+        esix.api.set_json_backend(old)
+    return results
+
+class _StaticTransport(esix.transport.Transport):
+    """Answers every GET with the same prepared page."""
+    def __init__(self, page):
+        self.page = page
+    def get(self, url, headers=None, stream=False):
+        return self.page
+
+@benchmark
+def search_streaming(args):
+    """First-result latency over HTTP and client-side peak memory for a
+    320-post page, with and without `post.search(stream=True)`."""
+    server = fakeserver.FakeServer.generate(num_posts=320, seed=args.seed,
+                                            description_size=8000)
+    page = server.handle('GET', server.base_url +
+                         'post/index.json?limit=320&page=1')
+    server.start()
+    results = {}
+    try:
+        with server:
+            for mode, stream in (('buffered', False), ('streamed', True)):
+                def first():
+                    for p in esix.post.search('', 320, stream=stream):
+                        return p
+                elapsed, _ = timed(first, args.repeat)
+                results['search_first_result_ms_' + mode] = (
+                    elapsed * 1000, 'ms', False)
+                # Serve a prepared page so the server's own allocations
+                # are not counted.
+                esix.api.set_transport(_StaticTransport(page))
+                gc.collect()
+                tracemalloc.start()
+                for p in esix.post.search('', 320, stream=stream): pass
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                server.install()
+                results['search_peak_kb_per_page_' + mode] = (
+                    peak / 1024.0, 'KB', False)
+    finally:
+        server.stop()
+    return results
+
+@benchmark
+def model_construction(args):
+    """Objects per second and bytes per object for the data classes."""
+    server = fakeserver.FakeServer.generate(num_posts=args.posts,
+                                            seed=args.seed)
+    raw = {
+        'post': (esix.post.Post, 'post_data',
+                 [server._post_out(p, server.base_url) for p in server.posts]),
+        'tag': (esix.tag.Tag, 'tag_data', server.tags),
+        'pool': (esix.pool.Pool, 'pool_data',
+                 [server._pool_out(p) for p in server.pools] * 50),
+    }
+    results = {}
+    for name, (cls, key, items) in raw.items():
+        elapsed, objs = timed(lambda: [cls(**{key: d}) for d in items],
+                              args.repeat)
+        results[name + '_objects_per_sec'] = (len(items) / elapsed,
+                                              'obj/s', True)
+        del objs
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objs = [cls(**{key: d}) for d in items]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name + '_bytes_per_object'] = ((after - before) / len(items),
+                                               'B', False)
+        del objs
+    return results
+
+@benchmark
+def downloads(args):
+    """Download throughput for `Post.download` over HTTP."""
+    count = 20
+    server = fakeserver.FakeServer.generate(num_posts=count, seed=args.seed,
+                                            file_size=args.file_size)
+    server.start()
+    dest = tempfile.mkdtemp()
+    try:
+        with server:
+            posts = list(esix.post.search('', 0))
+            def run():
+                for p in posts: p.download(dest, overwrite=True)
+            elapsed, _ = timed(run, args.repeat)
+    finally:
+        server.stop()
+        shutil.rmtree(dest)
+    size = count * args.file_size / 1048576.0
+    return {'download_mb_per_sec': (size / elapsed, 'MB/s', True)}
+
+@benchmark
+def md5_hashing(args):
+    """Hashing throughput for files on disk, as done by `post.from_file`
+    and the downloader's folder scan."""
+    dest = tempfile.mkdtemp()
+    count = 20
+    try:
+        for i in range(count):
+            with open(os.path.join(dest, str(i) + '.png'), 'wb') as f:
+                f.write(fakeserver._file_body(i, args.file_size))
+        def run():
+            for i in range(count):
+                with open(os.path.join(dest, str(i) + '.png'), 'rb') as f:
+                    hashlib.md5(f.read()).hexdigest()
+        elapsed, _ = timed(run, args.repeat)
+    finally:
+        shutil.rmtree(dest)
+    size = count * args.file_size / 1048576.0
+    return {'md5_mb_per_sec': (size / elapsed, 'MB/s', True)}
+
+@benchmark
+def md5_cache(args):
+    """Latency of the downloader's `.md5data` cache, hit and miss."""
+    import e621_downloader
+    dest = tempfile.mkdtemp() + '/'
+    try:
+        for i in range(200):
+            with open(dest + str(i) + '.png', 'wb') as f:
+                f.write(fakeserver._file_body(i, 16384))
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            miss, _ = timed(lambda: e621_downloader.gen_md5_list(dest),
+                            args.repeat)
+            hit, _ = timed(lambda: e621_downloader.get_md5_list(dest),
+                           args.repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    finally:
+        shutil.rmtree(dest)
+    return {'md5_cache_hit_ms': (hit * 1000, 'ms', False),
+            'md5_cache_miss_ms': (miss * 1000, 'ms', False)}
+
+@benchmark
+def response_cache(args):
+    """Latency of `Post(post_id)` with the response cache hit and missed,
+    against a server with 5ms of latency."""
+    server = fakeserver.FakeServer.generate(num_posts=100, seed=args.seed,
+                                            latency=0.005)
+    with server:
+        cache = esix.api.enable_cache()
+        try:
+            def miss():
+                cache.clear()
+                esix.post.Post(50)
+            miss_time, _ = timed(miss, args.repeat)
+            hit_time, _ = timed(lambda: esix.post.Post(50), args.repeat)
+        finally:
+            esix.api.disable_cache()
+    return {'response_cache_hit_ms': (hit_time * 1000, 'ms', False),
+            'response_cache_miss_ms': (miss_time * 1000, 'ms', False)}
+
+
+def run_all(args):
+    results = {}
+    for func in BENCHMARKS:
+        if args.only and func.__name__ not in args.only: continue
+        print('Running ' + func.__name__ + '...')
+        for name, (value, unit, higher) in sorted(func(args).items()):
+            results[name] = {'value': value, 'unit': unit,
+                             'higher_is_better': higher}
+            print('\t%-40s %14.2f %s' % (name, value, unit))
+    return results
+
+def compare(results, baseline, threshold):
+    """Print the change of each metric against a baseline run.
+
+    :returns: The names of metrics that regressed beyond the threshold.
+    :rtype: list
+    """
+    regressions = []
+    print('\nComparison against baseline:')
+    for name in sorted(results):
+        if name not in baseline: continue
+        old, new = baseline[name]['value'], results[name]['value']
+        if not old: continue
+        change = (new - old) / old
+        worse = -change if results[name]['higher_is_better'] else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('\t%-40s %+8.1f%%%s' % (name, change * 100, flag))
+    return regressions
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark esix against '+\
+                                     'a local fake server.')
+    parser.add_argument('--only', action='append',
+                        help='Only run the named benchmark. May be repeated.')
+    parser.add_argument('--posts', type=int, default=2000,
+                        help='Number of generated posts. Default 2000.')
+    parser.add_argument('--file-size', type=int, default=1048576,
+                        help='Size in bytes of downloaded files.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per benchmark; the best time is kept.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Compare results against this '+\
+                        'JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change counted as a regression. '+\
+                        'Default 0.1.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    results = run_all(args)
+    if args.save:
+        folder = os.path.dirname(args.save)
+        if folder and not os.path.isdir(folder): os.makedirs(folder)
+        with open(args.save, 'w') as f:
+            json.dump({'esix_version': esix.__version__,
+                       'python': platform.python_version(),
+                       'time': time.time(),
+                       'results': results}, f, indent=4, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold): sys.exit(1)
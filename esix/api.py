@@ -3,43 +3,453 @@
 Standard functions for e621's JSON API.
 """
 
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import itertools
 import json
-import requests
+import threading
 import time
 
-from . import config, errors
+from . import config, errors, jsonstream, transport
 
+try: import orjson
+except ImportError: orjson = None
+try: import ujson
+except ImportError: ujson = None
 
-def RateLimited(max_per_second):
-    min_interval = 1.0/float(max_per_second)
+# How far into a page to look for the site's "heavy load" message.
+HEAVY_LOAD_SCAN_BYTES = 4096
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+STREAM_CHUNK_SIZE = 16384
+# Request priority classes, most urgent first.
+INTERACTIVE = 0
+BULK = 1
+
+
+class RateLimiter(object):
+    def __init__(self, max_per_second=None):
+        """Create a rate limiter that hands out evenly spaced request slots.
+
+        :param max_per_second: The maximum calls per second. If None, the
+            value of `config.RATE_LIMIT` at call time is used. A rate of 0
+            disables limiting.
+        :type max_per_second: float
+        """
+        self.max_per_second = max_per_second
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """Returns the current maximum calls per second."""
+        if self.max_per_second is not None: return self.max_per_second
+        return config.RATE_LIMIT
+
+    def reserve(self):
+        """Reserve the next free slot.
+
+        :returns: The number of seconds to wait before the slot begins.
+        :rtype: float
+        """
+        rate = self.rate
+        if not rate: return 0.0
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0/float(rate)
+        return slot - now
+
+    def wait(self):
+        """Block until the next free slot begins."""
+        delay = self.reserve()
+        if delay > 0: time.sleep(delay)
+
+    def pending(self):
+        """Returns the number of seconds until the next slot is free,
+        without reserving it."""
+        if not self.rate: return 0.0
+        with self._lock: return max(0.0, self._next_slot - time.time())
+
+class PriorityScheduler(object):
+    def __init__(self, limiter=None, max_wait=None):
+        """Hand out a rate limiter's slots by priority. Waiting requests are
+        served most urgent class first (see `api.INTERACTIVE` and
+        `api.BULK`), and in the order they arrived within a class. A request
+        that has waited longer than its class's maximum wait is served
+        before any that have not, so busy urgent traffic cannot starve the
+        rest.
+
+        :param limiter: The rate limiter to schedule. Default is a new one
+            following `config.RATE_LIMIT`.
+        :type limiter: api.RateLimiter
+        :param max_wait: Seconds each priority class may wait before being
+            served ahead of the others. Default 30 for `api.BULK`, and no
+            limit for other classes.
+        :type max_wait: dict
+        """
+        self.limiter = limiter or RateLimiter()
+        self.max_wait = {BULK: 30.0} if max_wait is None else dict(max_wait)
+        self.served = collections.Counter()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _order(self, ticket, now):
+        priority, arrived, seq = ticket
+        limit = self.max_wait.get(priority)
+        if limit is not None and now - arrived >= limit: return (0, seq)
+        return (1, priority, seq)
+
+    def wait(self, priority=INTERACTIVE):
+        """Block until it is this request's turn for a slot.
+
+        :param priority: The request's priority class.
+        :type priority: int
+        """
+        ticket = (priority, time.time(), next(self._seq))
+        with self._cond:
+            self._waiting.append(ticket)
+            self._cond.notify_all()
+            was_first = False
+            try:
+                while True:
+                    now = time.time()
+                    first = min(self._waiting,
+                                key=lambda t: self._order(t, now))
+                    delay = self.limiter.pending()
+                    if first is ticket:
+                        if delay <= 0: break
+                        was_first = True
+                        self._cond.wait(delay)
+                        continue
+                    # Wake the request that is now first in line if this
+                    # one was holding the next slot for it.
+                    if was_first: self._cond.notify_all()
+                    was_first = False
+                    self._cond.wait()
+                # Another process sharing the limiter may have taken the
+                # slot since it was checked, so wait for the one reserved.
+                delay = self.limiter.reserve()
+                self.served[priority] += 1
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+        if delay > 0: time.sleep(delay)
+
+    def waiting(self):
+        """Returns the number of requests waiting in each priority class.
+
+        :rtype: dict
+        """
+        with self._cond:
+            return dict(collections.Counter(t[0] for t in self._waiting))
+
+class ResponseCache(object):
+    def __init__(self, ttl=300, max_entries=1000):
+        """Create a cache of raw GET responses, evicting the least recently
+        used entries once full.
+
+        :param ttl: Seconds an entry stays valid. None for no expiry.
+        :type ttl: float
+        :param max_entries: The most responses kept at once.
+        :type max_entries: int
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, url):
+        """Returns the cached body for a URL, or None."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and self.ttl is not None and \
+                    time.time() - entry[0] > self.ttl:
+                del self._entries[url]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, url, content):
+        """Store the body fetched from a URL."""
+        with self._lock:
+            self._entries[url] = (time.time(), content)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached responses."""
+        with self._lock: self._entries.clear()
+
+class SingleFlight(object):
+    def __init__(self):
+        """Create a registry of requests in flight, so that identical
+        requests made at the same time share a single call and its result.
+        """
+        self.requests = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Returns the future for a call in flight and whether the caller
+        is the one that must make it."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            self.requests += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future: del self._calls[key]
+        if error is not None: future.set_exception(error)
+        else: future.set_result(result)
+
+    def do(self, key, func):
+        """Call a function, or if a call with the same key is already in
+        flight, wait for it and return its result instead.
+
+        :param key: Identifies identical calls, e.g. the URL.
+        :type key: str
+        :param func: The function to call, taking no arguments.
+        :type func: function
+        :returns: The result of the call.
+        """
+        future, leader = self._join(key)
+        if not leader: return future.result()
+        try: result = func()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key, func):
+        """Coroutine version of `do`. Calls are shared with threads using
+        `do` as well as with other coroutines.
+
+        :param key: Identifies identical calls, e.g. the URL.
+        :type key: str
+        :param func: The coroutine function to call, taking no arguments.
+        :type func: function
+        :returns: The result of the call.
+        """
+        future, leader = self._join(key)
+        if not leader: return await asyncio.wrap_future(future)
+        try: result = await func()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def reset_stats(self):
+        """Set the request counters back to zero."""
+        with self._lock: self.requests = self.coalesced = 0
+
+def RateLimited(max_per_second=None):
+    limiter = RateLimiter(max_per_second)
     def decorate(func):
-        last_called = [0.0]
         def limited_func(*args,**kargs):
-            elapsed = time.clock()-last_called[0]
-            remaining = min_interval-elapsed
-            if remaining > 0:
-                time.sleep(remaining)
-            ret = func(*args,**kargs)
-            last_called[0] = time.clock()
-            return ret
+            limiter.wait()
+            return func(*args,**kargs)
+        limited_func.limiter = limiter
         return limited_func
     return decorate
 
-@RateLimited(2)
-def _get_page(url):
+_transport = None
+_async_transport = None
+_cache = None
+_flight = SingleFlight()
+_scheduler = PriorityScheduler()
+_priority = contextvars.ContextVar('esix_priority', default=None)
+_json_backend = None
+_json_loads = None
+
+def set_json_backend(name=None):
+    """Choose the library used to decode JSON responses.
+
+    :param name: 'orjson', 'ujson' or 'json'. If None, the fastest
+        installed backend is used.
+    :type name: str
+    :returns: The name of the backend now in use.
+    :rtype: str
+    :raises: ValueError
+    """
+    global _json_backend, _json_loads
+    available = {'orjson': orjson, 'ujson': ujson, 'json': json}
+    if name is None:
+        name = [n for n in JSON_BACKENDS if available[n] is not None][0]
+    if name not in available or available[name] is None:
+        raise ValueError('JSON backend ' + str(name) + ' is not available.')
+    _json_backend, _json_loads = name, available[name].loads
+    return name
+
+def get_json_backend():
+    """Returns the name of the library used to decode JSON responses.
+
+    :rtype: str
+    """
+    return _json_backend
+
+set_json_backend()
+
+def get_transport():
+    """Returns the transport used for all requests, creating the default
+    Requests-backed transport on first use.
+
+    :rtype: transport.Transport
+    """
+    global _transport
+    if _transport is None: _transport = transport.RequestsTransport()
+    return _transport
+
+def set_transport(new_transport):
+    """Replace the transport used for all requests.
+
+    :param new_transport: The transport to use, or None for the default.
+    :type new_transport: transport.Transport
+    :returns: The previously set transport.
+    :rtype: transport.Transport
+    """
+    global _transport
+    old, _transport = _transport, new_transport
+    return old
+
+def get_async_transport():
+    """Returns the transport used for asynchronous requests. By default this
+    runs the synchronous transport in an executor.
+
+    :rtype: transport.AsyncTransport
+    """
+    global _async_transport
+    if _async_transport is None: _async_transport = transport.AsyncTransport()
+    return _async_transport
+
+def set_async_transport(new_transport):
+    """Replace the transport used for asynchronous requests.
+
+    :param new_transport: The transport to use, or None for the default.
+    :type new_transport: transport.AsyncTransport
+    :returns: The previously set transport.
+    :rtype: transport.AsyncTransport
+    """
+    global _async_transport
+    old, _async_transport = _async_transport, new_transport
+    return old
+
+def enable_cache(ttl=300, max_entries=1000):
+    """Cache the responses of read-only API calls, so repeated lookups of
+    the same post, tag, comment, etc. do not make another request.
+
+    :param ttl: Seconds a response stays valid. None for no expiry.
+    :type ttl: float
+    :param max_entries: The most responses kept at once.
+    :type max_entries: int
+    :returns: The new cache.
+    :rtype: api.ResponseCache
+    """
+    global _cache
+    _cache = ResponseCache(ttl, max_entries)
+    return _cache
+
+def disable_cache():
+    """Stop caching responses and discard the cache."""
+    global _cache
+    _cache = None
+
+def get_cache():
+    """Returns the response cache, or None if caching is disabled.
+
+    :rtype: api.ResponseCache
+    """
+    return _cache
+
+def coalescing_stats():
+    """Returns how many GET requests were made and how many were saved by
+    sharing an identical request already in flight
+    (see `config.COALESCE_REQUESTS`).
+
+    :returns: A dict with 'requests' and 'coalesced' counts.
+    :rtype: dict
+    """
+    return {'requests': _flight.requests, 'coalesced': _flight.coalesced}
+
+def reset_coalescing_stats():
+    """Set the counts returned by `coalescing_stats` back to zero."""
+    _flight.reset_stats()
+
+def get_scheduler():
+    """Returns the scheduler that orders GET requests by priority.
+
+    :rtype: api.PriorityScheduler
+    """
+    return _scheduler
+
+@contextlib.contextmanager
+def priority(level):
+    """Make the requests made within a block (in the current thread or
+    task) use a priority class, e.g. `with api.priority(api.BULK):`.
+
+    :param level: The priority class, `api.INTERACTIVE` or `api.BULK`.
+    :type level: int
+    """
+    token = _priority.set(level)
+    try: yield
+    finally: _priority.reset(token)
+
+def get_priority(default=INTERACTIVE):
+    """Returns the priority class set by `priority` for the current thread
+    or task.
+
+    :param default: The class to return if none is set.
+    :type default: int
+    :rtype: int
+    """
+    level = _priority.get()
+    return default if level is None else level
+
+def _headers():
+    return {'User-Agent':config.USER_AGENT}
+
+def _get_page(url, stream=False, priority=None):
     """Fetch the content from a given web URL.
 
     :param url: The URL to fetch.
     :type url: str
+    :param stream: If True, the body is not read until it is iterated over.
+    :type stream: bool
+    :param priority: The request's priority class. Default is the class set
+        by `api.priority`, or else `api.INTERACTIVE`.
+    :type priority: int
     :returns: Response retrieved from URL.
     :rtype: HTTPResponse
     :raises: errors.APIGetError
     """
-    try: req = requests.get(url, headers={'User-Agent':config.USER_AGENT})
+    _scheduler.wait(get_priority() if priority is None else priority)
+    try: req = get_transport().get(url, headers=_headers(), stream=stream)
     except Exception as e: raise errors.APIGetError(str(e))
     return req
 
-@RateLimited(2)
+@RateLimited()
 def _post_data(data, url):
     """Post the given data object to the given URL.
 
@@ -51,10 +461,50 @@ def _post_data(data, url):
     :rtype: HTTPResponse
     :raises: errors.APIPostError
     """
-    err = None
+    try: req = get_transport().post(url, data=data, headers=_headers())
+    except Exception as e: raise errors.APIPostError(str(e))
+    return req
+
+_get_page.limiter = _scheduler.limiter
+
+async def _get_page_async(url, stream=False, priority=None):
+    """Coroutine version of `_get_page`, sharing its rate limit and queue.
+
+    :param url: The URL to fetch.
+    :type url: str
+    :param stream: If True, the body is not read until it is iterated over.
+    :type stream: bool
+    :param priority: The request's priority class.
+    :type priority: int
+    :returns: Response retrieved from URL.
+    :rtype: HTTPResponse
+    :raises: errors.APIGetError
+    """
+    if priority is None: priority = get_priority()
+    await asyncio.get_event_loop().run_in_executor(None, _scheduler.wait,
+                                                   priority)
+    try:
+        req = await get_async_transport().get(url, headers=_headers(),
+                                              stream=stream)
+    except Exception as e: raise errors.APIGetError(str(e))
+    return req
+
+async def _post_data_async(data, url):
+    """Coroutine version of `_post_data`, sharing its rate limit.
+
+    :param data: A dict or tuple of tuples with the data to post.
+    :type data: dict or tuple
+    :param url: The URL to post to.
+    :type url: str
+    :returns: Content of the response.
+    :rtype: HTTPResponse
+    :raises: errors.APIPostError
+    """
+    delay = _post_data.limiter.reserve()
+    if delay > 0: await asyncio.sleep(delay)
     try:
-        req = requests.post(url, data=data, 
-            headers={'User-Agent':config.USER_AGENT})
+        req = await get_async_transport().post(url, data=data,
+                                               headers=_headers())
     except Exception as e: raise errors.APIPostError(str(e))
     return req
 
@@ -67,20 +517,168 @@ def _get_data_obj(page):
     :rtype: dict or list
     :raises: errors.JSONError
     """
-    try: data = json.loads(page.text)
-    except (ValueError, AttributeError):
-        if 'This website is under heavy load' in page.text:
+    # Decoding the raw bytes skips Requests' encoding detection, which is
+    # slow on large pages; the JSON is always UTF-8.
+    try: data = _json_loads(page.content)
+    except (ValueError, AttributeError, TypeError):
+        head = getattr(page, 'content', b'')[:HEAVY_LOAD_SCAN_BYTES]
+        if b'This website is under heavy load' in head:
             raise errors.SiteLoadError('API call failed. ' +\
                 'The site is under heavy load.')
         raise errors.JSONError('The supplied page data is not JSON-decodable.')
     return data
 
-def _fetch_data(url):
+def _fetch_data(url, priority=None):
     """Fetches a URL's page content, then converts it into a JSON object.
 
     :param url: The URL of the JSON-encoded page.
     :type url: str
+    :param priority: The request's priority class.
+    :type priority: int
+    :returns: The decoded JSON object.
+    :rtype: dict
+    """
+    cache = _cache
+    if cache is not None:
+        content = cache.get(url)
+        if content is not None:
+            return _get_data_obj(transport.Response(url, 200, {}, content))
+    # Callers sharing a request each decode their own copy of the data, as
+    # the objects built from it may change it.
+    if config.COALESCE_REQUESTS:
+        page = _flight.do(url, lambda: _get_page(url, priority=priority))
+    else: page = _get_page(url, priority=priority)
+    data = _get_data_obj(page)
+    if cache is not None: cache.put(url, page.content)
+    return data
+
+def _fetch_many(urls, workers=None, priority=None, skip_errors=False):
+    """Fetch several URLs concurrently, sharing the rate limit. Results are
+    returned in the order of the URLs, as each becomes available.
+
+    :param urls: The URLs of the JSON-encoded pages.
+    :type urls: list
+    :param workers: The most requests in flight at once. Default is
+        `config.MAX_WORKERS`.
+    :type workers: int
+    :param priority: The requests' priority class. Default is the class set
+        by `api.priority`, or else `api.INTERACTIVE`.
+    :type priority: int
+    :param skip_errors: If True, a URL that fails to load gives None instead
+        of raising its error, so one failure does not lose the rest.
+    :type skip_errors: bool
+    :returns: A generator of the decoded JSON objects.
+    :rtype: generator object
+    :raises: errors.APIError, errors.JSONError unless skipping errors
+    """
+    urls = list(urls)
+    if not urls: return
+    workers = min(workers or config.MAX_WORKERS, len(urls))
+    # Worker threads do not see the caller's `api.priority`, so pass it on.
+    level = get_priority() if priority is None else priority
+    def fetch(url):
+        if not skip_errors: return _fetch_data(url, level)
+        try: return _fetch_data(url, level)
+        except (errors.APIError, errors.JSONError): return None
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for data in executor.map(fetch, urls):
+            yield data
+
+def _fetch_before_id(url, since_id=None, per_page=100, prefetch=False):
+    """Walk a listing that pages with `before_id` (newest first), such as
+    tag or flag history, until it ends or reaches an ID already seen.
+
+    :param url: The URL of the listing, including its query string.
+    :type url: str
+    :param since_id: Stop before items with this ID or lower. The ID of the
+        first item returned can be saved and passed here next time.
+    :type since_id: int
+    :param per_page: The number of items to request per page.
+    :type per_page: int
+    :param prefetch: If True, fetch the next page in the background while
+        the current one is being used.
+    :type prefetch: bool
+    :returns: A generator of the decoded items, newest first.
+    :rtype: generator object
+    """
+    url += '&limit=' + str(per_page)
+    level = get_priority()
+    executor = concurrent.futures.ThreadPoolExecutor(1) if prefetch else None
+    def page_url(before_id):
+        if before_id is None: return url
+        return url + '&before_id=' + str(before_id)
+    try:
+        rs = _fetch_data(page_url(None))
+        while True:
+            more = len(rs) >= per_page and \
+                (since_id is None or rs[-1]['id'] > since_id)
+            upcoming = None
+            if more and executor is not None:
+                upcoming = executor.submit(_fetch_data,
+                                           page_url(rs[-1]['id']), level)
+            for item in rs:
+                if since_id is not None and item['id'] <= since_id: return
+                yield item
+            if not more: return
+            if upcoming is not None: rs = upcoming.result()
+            else: rs = _fetch_data(page_url(rs[-1]['id']))
+    finally:
+        if executor is not None: executor.shutdown(wait=False)
+
+def _stream_data(url, priority=None):
+    """Fetches a URL whose content is a JSON array, yielding each element
+    as soon as it has been downloaded rather than waiting for the page.
+
+    :param url: The URL of the JSON-encoded page.
+    :type url: str
+    :param priority: The request's priority class.
+    :type priority: int
+    :returns: A generator of the decoded array elements.
+    :rtype: generator object
+    :raises: errors.JSONError
+    """
+    page = _get_page(url, stream=True, priority=priority)
+    chunks = page.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if head.strip(): break
+    if not head.lstrip().startswith(b'['):
+        # Not an array (an error page or message), so decode it as a whole.
+        data = _get_data_obj(transport.Response(page.url, page.status_code,
+            page.headers, head + b''.join(chunks)))
+        if not isinstance(data, list):
+            raise errors.JSONError('The supplied page data is not a list.')
+        for item in data: yield item
+        return
+    try:
+        for item in jsonstream.iter_array(itertools.chain([head], chunks),
+                                          _json_loads):
+            yield item
+    except ValueError:
+        raise errors.JSONError('The supplied page data is not JSON-decodable.')
+    finally:
+        page.close()
+
+async def _fetch_data_async(url, priority=None):
+    """Coroutine version of `_fetch_data`.
+
+    :param url: The URL of the JSON-encoded page.
+    :type url: str
+    :param priority: The request's priority class.
+    :type priority: int
     :returns: The decoded JSON object.
     :rtype: dict
     """
-    return _get_data_obj(_get_page(url))
\ No newline at end of file
+    cache = _cache
+    if cache is not None:
+        content = cache.get(url)
+        if content is not None:
+            return _get_data_obj(transport.Response(url, 200, {}, content))
+    if config.COALESCE_REQUESTS:
+        page = await _flight.do_async(
+            url, lambda: _get_page_async(url, priority=priority))
+    else: page = await _get_page_async(url, priority=priority)
+    data = _get_data_obj(page)
+    if cache is not None: cache.put(url, page.content)
+    return data
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Record and replay of HTTP traffic, for reproducing crawls offline.
+
+A cassette is a gzip-compressed file with one JSON object per request,
+holding the URL, status, headers, body and timing of each response.
+"""
+
+import base64
+import contextlib
+import gzip
+import json
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from . import api, errors, transport
+
+# Form fields and JSON response fields that are never written to a
+# cassette.
+PRIVATE_FIELDS = ('password', 'password_hash')
+
+
+def _form_key(data):
+    """Returns a stable, credential-free representation of POST data."""
+    if not data: return None
+    items = data.items() if hasattr(data, 'items') else data
+    return sorted([str(k), '*' if k in PRIVATE_FIELDS else str(v)]
+                  for k, v in items)
+
+def _redact(value):
+    """Returns a copy of decoded JSON with private fields masked."""
+    if isinstance(value, dict):
+        return dict((k, '*' if k in PRIVATE_FIELDS else _redact(v))
+                    for k, v in value.items())
+    if isinstance(value, list): return [_redact(v) for v in value]
+    return value
+
+def _scrub_body(body):
+    """Returns a response body with private fields masked, such as the
+    password hash returned by `user/login.json`."""
+    if not any('"' + field + '"' in body for field in PRIVATE_FIELDS):
+        return body
+    try: return json.dumps(_redact(json.loads(body)))
+    except ValueError: return body
+
+def load(path):
+    """Load the entries of a cassette.
+
+    :param path: The cassette file.
+    :type path: str
+    :returns: The recorded entries, in the order they were made.
+    :rtype: list
+    """
+    with gzip.open(path, 'rt') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+@contextlib.contextmanager
+def recording(path, inner=None):
+    """Record all requests made inside a `with` block to a cassette.
+
+    :param path: The cassette file to write.
+    :type path: str
+    :param inner: The transport to record. Default is the current one.
+    :type inner: transport.Transport
+    """
+    recorder = RecordingTransport(path, inner)
+    old = api.set_transport(recorder)
+    try: yield recorder
+    finally:
+        api.set_transport(old)
+        recorder.save()
+
+@contextlib.contextmanager
+def replaying(path, timing=None, scale=1.0):
+    """Serve all requests made inside a `with` block from a cassette.
+
+    :param path: The cassette file to read.
+    :type path: str
+    :param timing: None to answer immediately, 'elapsed' to wait as long as
+        each original response took, or 'original' to also keep the
+        original gaps between requests.
+    :type timing: str
+    :param scale: Multiplier applied to all recorded delays.
+    :type scale: float
+    """
+    player = ReplayTransport(path, timing, scale)
+    old = api.set_transport(player)
+    try: yield player
+    finally: api.set_transport(old)
+
+
+class RecordingTransport(transport.Transport):
+    def __init__(self, path, inner=None):
+        """Create a transport that passes requests on to another transport
+        and records each exchange.
+
+        :param path: The cassette file to write on `save`.
+        :type path: str
+        :param inner: The transport that makes the real requests. Default is
+            the transport currently set in `esix.api`.
+        :type inner: transport.Transport
+        """
+        self.path = path
+        self.inner = inner or api.get_transport()
+        self.entries = []
+        self._start = time.time()
+        self._lock = threading.Lock()
+
+    def _record(self, method, url, data, call):
+        started = time.time()
+        response = call()
+        content = response.content
+        elapsed = time.time() - started
+        try: body, encoding = _scrub_body(content.decode('utf-8')), 'utf-8'
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content).decode('ascii'), \
+                'base64'
+        entry = {
+            'method': method, 'url': url, 'data': _form_key(data),
+            'status': response.status_code,
+            'headers': dict(response.headers), 'body': body,
+            'encoding': encoding, 'offset': round(started - self._start, 6),
+            'elapsed': round(elapsed, 6),
+        }
+        with self._lock: self.entries.append(entry)
+        return transport.Response(response.url, response.status_code,
+                                  response.headers, content)
+
+    def get(self, url, headers=None, stream=False):
+        return self._record('GET', url, None, lambda: self.inner.get(
+            url, headers=headers, stream=stream))
+
+    def post(self, url, data=None, headers=None):
+        return self._record('POST', url, data, lambda: self.inner.post(
+            url, data=data, headers=headers))
+
+    def save(self, path=None):
+        """Write all recorded entries to the cassette.
+
+        :param path: The file to write. Default is the recorder's path.
+        :type path: str
+        """
+        with self._lock: entries = sorted(self.entries,
+                                          key=lambda e: e['offset'])
+        with gzip.open(path or self.path, 'wt') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.save()
+        self.inner.close()
+
+
+class ReplayTransport(transport.Transport):
+    def __init__(self, path, timing=None, scale=1.0):
+        """Create a transport that answers requests from a cassette.
+        Requests are matched on method, path, query and form data, and
+        identical requests are answered in the order they were recorded.
+
+        :param path: The cassette file to read.
+        :type path: str
+        :param timing: None to answer immediately, 'elapsed' to wait as long
+            as each original response took, or 'original' to also keep the
+            original gaps between requests.
+        :type timing: str
+        :param scale: Multiplier applied to all recorded delays.
+        :type scale: float
+        """
+        if timing not in (None, 'elapsed', 'original'):
+            raise ValueError('Unknown replay timing: ' + str(timing))
+        self.timing = timing
+        self.scale = scale
+        self.entries = load(path)
+        self.misses = []
+        self._queues = {}
+        for entry in self.entries:
+            key = self._key(entry['method'], entry['url'], entry['data'])
+            self._queues.setdefault(key, []).append(entry)
+        self._start = None
+        self._lock = threading.Lock()
+
+    def _key(self, method, url, data):
+        # Hosts are ignored so a crawl can be replayed under any BASE_URL.
+        parts = urlsplit(url)
+        return (method, parts.path + '?' + parts.query, json.dumps(data))
+
+    def _play(self, method, url, data):
+        key = self._key(method, url, _form_key(data))
+        with self._lock:
+            if self._start is None: self._start = time.time()
+            queue = self._queues.get(key)
+            if not queue:
+                self.misses.append((method, url))
+                raise errors.APIError('No recorded response for ' + method +
+                                      ' ' + url)
+            entry = queue.pop(0) if len(queue) > 1 else queue[0]
+        if self.timing == 'original':
+            delay = self._start + entry['offset'] * self.scale - time.time()
+            if delay > 0: time.sleep(delay)
+        if self.timing is not None and entry['elapsed'] > 0:
+            time.sleep(entry['elapsed'] * self.scale)
+        if entry['encoding'] == 'base64':
+            content = base64.b64decode(entry['body'])
+        else: content = entry['body'].encode('utf-8')
+        return transport.Response(url, entry['status'], entry['headers'],
+                                  content)
+
+    def get(self, url, headers=None, stream=False):
+        return self._play('GET', url, None)
+
+    def post(self, url, data=None, headers=None):
+        return self._play('POST', url, data)
@@ -3,8 +3,13 @@
 Comment class for the e621 API.
 """
 
+import concurrent.futures
+
 from . import api, config, errors
 
+# Comments returned per page of `comment/index.json`.
+COMMENTS_PER_PAGE = 25
+
 
 def recent():
     """Get a list of the 25 most recent comments made site-wide.
@@ -16,6 +21,83 @@ def recent():
     for comment_data in api._fetch_data(url):
         yield Comment(comment_data=comment_data)
 
+def for_post(post_id):
+    """Fetch all comments made on a post, newest first.
+
+    :param post_id: The ID number of the post.
+    :type post_id: int
+    :returns: The post's comments.
+    :rtype: list
+    """
+    url = config.BASE_URL + 'comment/index.json?post_id=' + str(post_id)
+    comments = []
+    page = 1
+    while True:
+        rs = api._fetch_data(url + '&page=' + str(page))
+        for comment_data in rs:
+            comments.append(Comment(comment_data=comment_data))
+        # A short page is the last one, so no empty page needs fetching.
+        if len(rs) < COMMENTS_PER_PAGE: break
+        page += 1
+    return comments
+
+def for_posts(posts, workers=None):
+    """Fetch the comments of many posts at once. Posts known to have no
+    comments are skipped without a request.
+
+    :param posts: Post objects, or the ID numbers of posts.
+    :type posts: list
+    :param workers: The most posts fetched at once.
+        Default is `config.MAX_WORKERS`.
+    :type workers: int
+    :returns: A dict of post ID to a list of its comments, newest first.
+        Posts whose comments could not be fetched are left out.
+    :rtype: dict
+    """
+    result = {}
+    post_ids = []
+    seen = set()
+    for p in posts:
+        post_id = getattr(p, 'id', p)
+        if getattr(p, 'has_comments', True) is False: result[post_id] = []
+        elif post_id not in seen:
+            seen.add(post_id)
+            post_ids.append(post_id)
+    if not post_ids: return result
+    # Worker threads do not see the caller's `api.priority`, so pass it on.
+    level = api.get_priority(api.BULK)
+    def fetch(post_id):
+        try:
+            with api.priority(level): return for_post(post_id)
+        except (errors.APIError, errors.JSONError): return None
+    workers = min(workers or config.MAX_WORKERS, len(post_ids))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for post_id, comments in zip(post_ids, executor.map(fetch, post_ids)):
+            if comments is not None: result[post_id] = comments
+    return result
+
+def fetch_many(comment_ids, workers=None):
+    """Load many comments by ID at once.
+
+    :param comment_ids: The ID numbers of the comments to load.
+    :type comment_ids: list
+    :param workers: The most requests in flight at once.
+        Default is `config.MAX_WORKERS`.
+    :type workers: int
+    :returns: A dict of comment ID to comment. Comments that could not be
+        found or loaded are left out.
+    :rtype: dict
+    """
+    comment_ids = list(dict.fromkeys(comment_ids))
+    urls = [config.BASE_URL + 'comment/show.json?id=' + str(comment_id)
+            for comment_id in comment_ids]
+    comments = {}
+    for comment_id, data in zip(comment_ids, api._fetch_many(
+            urls, workers, skip_errors=True)):
+        if isinstance(data, dict) and 'id' in data:
+            comments[comment_id] = Comment(comment_data=data)
+    return comments
+
 def submit(post_id, body):
     """Create and submit a comment on a post.
 
@@ -49,10 +131,10 @@ class Comment(object):
             self._data[prop] = None
         if comment_id is not None:
             try:
-                data = api._get_data_obj(api._post_data({'id':str(comment_id)},
-                    config.BASE_URL + 'comment/show.json'))
+                data = api._fetch_data(config.BASE_URL +\
+                    'comment/show.json?id=' + str(comment_id))
                 for prop in data: self._data[prop] = data[prop]
-            except (errors.APIPostError, errors.JSONError):
+            except (errors.APIGetError, errors.JSONError):
                 raise errors.CommentNotFoundError('The requested comment ' +\
                     'could not be found.')
         if comment_data is not None:
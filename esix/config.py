@@ -3,3 +3,6 @@ BASE_URL = 'https://e621.net/'
 USER_AGENT = 'Python-Esix v' + __version__
 USERNAME = ''
 PASSWORD = ''
+RATE_LIMIT = 2
+MAX_WORKERS = 4
+COALESCE_REQUESTS = True
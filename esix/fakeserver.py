@@ -0,0 +1,744 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the e621 JSON API, for tests and benchmarks.
+
+The server holds generated (or hand-written) fixtures and answers the same
+endpoints the library uses. It can be called in-process through
+`FakeTransport`, or started as a real HTTP server on localhost.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qsl
+from xml.sax.saxutils import quoteattr
+
+from . import api, config, transport
+
+IN_PROCESS_URL = 'http://e621.fake/'
+HEAVY_LOAD_PAGE = b'<html><body><h1>This website is under heavy load</h1>' +\
+    b'<p>Please try again later.</p></body></html>'
+
+POSTS_PER_PAGE_MAX = 320
+POOL_POSTS_PER_PAGE = 24
+POOLS_PER_PAGE = 20
+TAGS_PER_PAGE = 50
+FORUM_POSTS_PER_PAGE = 30
+TICKETS_PER_PAGE = 50
+COMMENTS_PER_PAGE = 25
+HISTORY_PER_PAGE = 100
+
+WORDS = ['canine', 'feline', 'avian', 'dragon', 'solo', 'duo', 'group',
+         'outside', 'inside', 'night', 'day', 'smile', 'sitting', 'standing',
+         'blue_eyes', 'green_eyes', 'fur', 'scales', 'feathers', 'tail',
+         'wings', 'horns', 'clothed', 'hat', 'flower', 'tree', 'water', 'sky',
+         'snow', 'digital_media', 'traditional_media', 'sketch', 'comic',
+         'text', 'english_text', 'signature', 'hi_res', 'absurd_res']
+
+
+def _timestamp(seconds):
+    return {'json_class': 'Time', 's': int(seconds), 'n': 0}
+
+def _file_body(post_id, size):
+    """Returns the deterministic file body for a generated post."""
+    block = hashlib.sha256(str(post_id).encode('utf-8')).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+class FakeServer(object):
+    def __init__(self, posts=None, comments=None, users=None, tags=None,
+                 pools=None, forum_posts=None, tickets=None, favorites=None,
+                 tag_history=None, flag_history=None, files=None,
+                 latency=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                 load_error_rate=0.0, seed=None):
+        """Create a fake e621 server from fixture data.
+
+        :param posts: Raw post data, as returned by `post/show.json`.
+        :type posts: list
+        :param comments: Raw comment data.
+        :type comments: list
+        :param users: Raw user data.
+        :type users: list
+        :param tags: Raw tag data.
+        :type tags: list
+        :param pools: Raw pool data, each with a `post_ids` list.
+        :type pools: list
+        :param forum_posts: Raw forum post data, threads and replies.
+        :type forum_posts: list
+        :param tickets: Raw ticket data.
+        :type tickets: list
+        :param favorites: Dict of post ID to a list of usernames.
+        :type favorites: dict
+        :param tag_history: Raw `post_tag_history` entries.
+        :type tag_history: list
+        :param flag_history: Raw `post_flag_history` entries.
+        :type flag_history: list
+        :param files: Dict of file path (relative to the site root) to bytes.
+        :type files: dict
+        :param latency: Seconds to wait before answering each request.
+        :type latency: float
+        :param jitter: Maximum extra random seconds added to the latency.
+        :type jitter: float
+        :param error_rate: Chance (0-1) of answering with `error_status`.
+        :type error_rate: float
+        :param error_status: The HTTP status used for injected errors.
+        :type error_status: int
+        :param load_error_rate: Chance (0-1) of answering with the site's
+            "heavy load" HTML page.
+        :type load_error_rate: float
+        :param seed: Seed for latency jitter and error injection.
+        :type seed: int
+        """
+        self.posts = sorted(posts or [], key=lambda p: p['id'], reverse=True)
+        self.comments = sorted(comments or [], key=lambda c: c['id'],
+                               reverse=True)
+        self.users = users or []
+        self.tags = sorted(tags or [], key=lambda t: t['name'])
+        self.pools = sorted(pools or [], key=lambda p: p['id'], reverse=True)
+        self.forum_posts = sorted(forum_posts or [], key=lambda p: p['id'],
+                                  reverse=True)
+        self.tickets = sorted(tickets or [], key=lambda t: t['id'],
+                              reverse=True)
+        self.favorites = favorites or {}
+        self.tag_history = sorted(tag_history or [], key=lambda h: h['id'],
+                                  reverse=True)
+        self.flag_history = sorted(flag_history or [], key=lambda h: h['id'],
+                                   reverse=True)
+        self.files = files or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.load_error_rate = load_error_rate
+        self.hits = {}
+        self._random = random.Random(seed)
+        self._forced_errors = []
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self._installed = None
+        self._routes = {
+            'post/index.json': self._post_index,
+            'post/show.json': self._post_show,
+            'post/popular_by_day.json': self._post_popular,
+            'post/popular_by_week.json': self._post_popular,
+            'post/popular_by_month.json': self._post_popular,
+            'favorite/list_users.json': self._favorite_list_users,
+            'post_tag_history/index.json': self._tag_history_index,
+            'post_flag_history/index.json': self._flag_history_index,
+            'comment/index.json': self._comment_index,
+            'comment/show.json': self._comment_show,
+            'user/index.json': self._user_index,
+            'tag/index.json': self._tag_index,
+            'tag/related.json': self._tag_related,
+            'pool/index.json': self._pool_index,
+            'pool/show.json': self._pool_show,
+            'forum/index.json': self._forum_index,
+            'forum/show.json': self._forum_show,
+            'ticket/index.json': self._ticket_index,
+            'ticket/show.json': self._ticket_show,
+        }
+        self._index()
+
+    @classmethod
+    def generate(cls, num_posts=500, num_users=50, num_pools=10,
+                 num_threads=5, num_tickets=20, file_size=4096,
+                 description_size=200, seed=0, **kwargs):
+        """Create a fake server filled with randomly generated fixtures.
+
+        :param num_posts: The number of posts to generate.
+        :type num_posts: int
+        :param num_users: The number of users to generate.
+        :type num_users: int
+        :param num_pools: The number of pools to generate.
+        :type num_pools: int
+        :param num_threads: The number of forum threads to generate.
+        :type num_threads: int
+        :param num_tickets: The number of tickets to generate.
+        :type num_tickets: int
+        :param file_size: The size in bytes of each post's file.
+        :type file_size: int
+        :param description_size: Approximate length of post descriptions.
+        :type description_size: int
+        :param seed: Seed for the random generator, for reproducible data.
+        :type seed: int
+        :returns: A server serving the generated data.
+        :rtype: fakeserver.FakeServer
+        """
+        rng = random.Random(seed)
+        base_time = 1400000000
+        users = [{'id': i, 'name': 'user_' + str(i), 'level': rng.choice(
+                    [20, 20, 20, 30, 33, 34, 40, 50]),
+                  'created_at': '2014-01-01 00:00', 'subscriptions': {}}
+                 for i in range(1, num_users+1)]
+        artists = ['artist_' + str(i) for i in range(1, num_users // 2 + 2)]
+        posts, comments, history, flags, favorites = [], [], [], [], {}
+        tag_counts = {}
+        for post_id in range(1, num_posts+1):
+            creator = rng.choice(users)
+            tags = set(rng.sample(WORDS, rng.randint(3, 12)))
+            tags.add(rng.choice(artists))
+            tags = sorted(tags)
+            for t in tags: tag_counts[t] = tag_counts.get(t, 0) + 1
+            ext = rng.choice(['jpg', 'jpg', 'png', 'gif'])
+            body = _file_body(post_id, file_size)
+            md5 = hashlib.md5(body).hexdigest()
+            path = 'data/' + md5[0:2] + '/' + md5[2:4] + '/' + md5 + '.' + ext
+            created = base_time + post_id * 600
+            words = [rng.choice(WORDS) for i in range(description_size // 8)]
+            posts.append({
+                'id': post_id, 'tags': ' '.join(tags),
+                'locked_tags': None, 'description': ' '.join(words),
+                'created_at': _timestamp(created),
+                'creator_id': creator['id'], 'author': creator['name'],
+                'change': post_id * 10, 'source': None, 'sources': [],
+                'score': rng.randint(-5, 200), 'fav_count': 0,
+                'md5': md5, 'file_size': file_size, 'file_ext': ext,
+                'file_url': path, 'preview_url': path,
+                'preview_width': 150, 'preview_height': 150,
+                'sample_url': path, 'sample_width': 800,
+                'sample_height': 600, 'width': 800, 'height': 600,
+                'rating': rng.choice('sqe'), 'status': 'active',
+                'has_comments': False, 'has_notes': False,
+                'has_children': False, 'children': '', 'parent_id': None,
+                'artist': [t for t in tags if t.startswith('artist_')],
+            })
+            for i in range(rng.choice([0, 0, 0, 1, 2, 3, 30])):
+                c_user = rng.choice(users)
+                comments.append({
+                    'id': len(comments)+1, 'post_id': post_id,
+                    'creator': c_user['name'], 'creator_id': c_user['id'],
+                    'body': 'Comment ' + str(len(comments)+1),
+                    'score': rng.randint(-2, 10),
+                    'created_at': '2014-01-01 00:00'})
+                posts[-1]['has_comments'] = True
+            fav_users = rng.sample(users, rng.randint(0, min(10, num_users)))
+            favorites[post_id] = [u['name'] for u in fav_users]
+            posts[-1]['fav_count'] = len(fav_users)
+            edit_tags = list(tags)
+            for i in range(rng.randint(1, 3)):
+                h_user = rng.choice(users)
+                if i:
+                    edit_tags = sorted(set(edit_tags) |
+                                       set([rng.choice(WORDS)]))
+                history.append({
+                    'id': 0, 'post_id': post_id, 'tags': ' '.join(edit_tags),
+                    'created_at': _timestamp(created + i * 60),
+                    'user_id': h_user['id'], 'user': h_user['name']})
+            if rng.random() < 0.05:
+                f_user = rng.choice(users)
+                flags.append({
+                    'id': len(flags)+1, 'post_id': post_id,
+                    'reason': 'Duplicate', 'user_id': f_user['id'],
+                    'created_at': _timestamp(created + 3600)})
+        history.sort(key=lambda h: (h['created_at']['s'], h['post_id']))
+        for i, h in enumerate(history): h['id'] = i + 1
+        type_of = dict((w, 0) for w in WORDS)
+        type_of.update(dict((a, 1) for a in artists))
+        tags = [{'id': i+1, 'name': name, 'count': tag_counts.get(name, 0),
+                 'type': type_of[name], 'ambiguous': False}
+                for i, name in enumerate(sorted(type_of))]
+        pools = []
+        for pool_id in range(1, num_pools+1):
+            size = rng.randint(1, min(100, num_posts))
+            start = rng.randint(1, max(1, num_posts-size+1))
+            pools.append({
+                'id': pool_id, 'name': 'pool_' + str(pool_id),
+                'user_id': rng.choice(users)['id'],
+                'created_at': _timestamp(base_time + pool_id),
+                'updated_at': _timestamp(base_time + pool_id * 100),
+                'is_public': True, 'is_active': True, 'is_locked': False,
+                'description': 'Pool ' + str(pool_id),
+                'post_ids': list(range(start, start+size))})
+        forum_posts = []
+        for i in range(num_threads):
+            op_user = rng.choice(users)
+            op = {'id': len(forum_posts)+1, 'parent_id': None,
+                  'creator': op_user['name'], 'creator_id': op_user['id'],
+                  'title': 'Thread ' + str(i+1), 'body': 'Opening post',
+                  'created_at': '2014-01-01 00:00'}
+            forum_posts.append(op)
+            for j in range(rng.choice([0, 3, 40, 95])):
+                r_user = rng.choice(users)
+                forum_posts.append({
+                    'id': len(forum_posts)+1, 'parent_id': op['id'],
+                    'creator': r_user['name'], 'creator_id': r_user['id'],
+                    'title': 'Re: Thread ' + str(i+1),
+                    'body': 'Reply ' + str(j+1),
+                    'created_at': '2014-01-01 00:00'})
+        tickets = []
+        for ticket_id in range(1, num_tickets+1):
+            t_user = rng.choice(users)
+            tickets.append({
+                'id': ticket_id, 'type': 'comment', 'status': 'pending',
+                'user': t_user['id'], 'username': t_user['name'],
+                'created_at': '2014-01-01 00:00',
+                'updated_at': '2014-01-01 00:00',
+                'reason': 'Spam',
+                'reported_comment': rng.choice(comments)['id']
+                    if comments else None})
+        return cls(posts=posts, comments=comments, users=users, tags=tags,
+                   pools=pools, forum_posts=forum_posts, tickets=tickets,
+                   favorites=favorites, tag_history=history,
+                   flag_history=flags, seed=seed, **kwargs)
+
+    def _index(self):
+        """Build lookup tables over the fixtures."""
+        self._posts_by_id = dict((p['id'], p) for p in self.posts)
+        self._file_posts = {}
+        for p in self.posts:
+            if p.get('file_url') and '://' not in p['file_url']:
+                self._file_posts[p['file_url']] = p
+        self._comments_by_id = dict((c['id'], c) for c in self.comments)
+        self._forum_by_id = dict((p['id'], p) for p in self.forum_posts)
+        for p in self.forum_posts:
+            if p.get('parent_id') is None:
+                p['response_count'] = len([r for r in self.forum_posts
+                                           if r.get('parent_id') == p['id']])
+
+    # Server control
+
+    @property
+    def base_url(self):
+        """Returns the base URL the server is reachable at."""
+        if self._httpd is None: return IN_PROCESS_URL
+        return 'http://%s:%d/' % self._httpd.server_address[:2]
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start serving over HTTP in a background thread.
+
+        :param host: The interface to listen on.
+        :type host: str
+        :param port: The port to listen on. Default picks a free port.
+        :type port: int
+        :returns: This server.
+        :rtype: fakeserver.FakeServer
+        """
+        if self._httpd is not None: return self
+        self._httpd = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._httpd.fake = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the HTTP server, if running."""
+        if self._httpd is None: return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._httpd = self._thread = None
+
+    def install(self, rate_limit=0):
+        """Point the library at this server. In-process unless the HTTP
+        server has been started.
+
+        :param rate_limit: The rate limit to use while installed.
+            Default 0 (unlimited).
+        :type rate_limit: float
+        :returns: This server.
+        :rtype: fakeserver.FakeServer
+        """
+        if self._installed is None:
+            self._installed = (config.BASE_URL, config.RATE_LIMIT,
+                               api.set_transport(None))
+        config.BASE_URL = self.base_url
+        config.RATE_LIMIT = rate_limit
+        if self._httpd is None: api.set_transport(FakeTransport(self))
+        else: api.set_transport(transport.RequestsTransport())
+        return self
+
+    def uninstall(self):
+        """Restore the library settings replaced by `install`."""
+        if self._installed is None: return
+        config.BASE_URL, config.RATE_LIMIT, old = self._installed
+        api.set_transport(old)
+        self._installed = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    def inject_errors(self, count=1, status=None):
+        """Make the next requests fail, regardless of `error_rate`.
+
+        :param count: The number of requests to fail.
+        :type count: int
+        :param status: The HTTP status to fail with, or None for the
+            site's "heavy load" page.
+        :type status: int
+        """
+        with self._lock: self._forced_errors.extend([status] * count)
+
+    @property
+    def request_count(self):
+        """Returns the total number of requests answered."""
+        return sum(self.hits.values())
+
+    def reset_hits(self):
+        """Clear the per-endpoint request counters."""
+        with self._lock: self.hits = {}
+
+    # Request handling
+
+    def handle(self, method, url, data=None):
+        """Answer a single request.
+
+        :param method: The HTTP method, GET or POST.
+        :type method: str
+        :param url: The full request URL.
+        :type url: str
+        :param data: Form data sent with a POST request.
+        :type data: dict
+        :returns: The server's response.
+        :rtype: transport.Response
+        """
+        parts = urlsplit(url)
+        path = parts.path.lstrip('/')
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        if data: params.update(dict(data))
+        with self._lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            forced = self._forced_errors.pop(0) if self._forced_errors \
+                else False
+            roll = self._random.random()
+            delay = self.latency + self._random.random() * self.jitter
+        if delay > 0: time.sleep(delay)
+        if forced is not False:
+            if forced is None: return self._heavy_load(url)
+            return transport.Response(url, forced, {'Content-Type':
+                'text/html'}, b'<html><body>Error</body></html>')
+        if roll < self.error_rate:
+            return transport.Response(url, self.error_status, {'Content-Type':
+                'text/html'}, b'<html><body>Error</body></html>')
+        if roll < self.error_rate + self.load_error_rate:
+            return self._heavy_load(url)
+        root = parts.scheme + '://' + parts.netloc + '/'
+        if path in self._routes:
+            return self._json(url, self._routes[path](params, root))
+        if path == 'post/index.xml':
+            return self._xml(url, self._post_index_xml(params, root))
+        if path in self.files:
+            return self._file(url, path, self.files[path])
+        if path in self._file_posts:
+            p = self._file_posts[path]
+            return self._file(url, path, _file_body(p['id'], p['file_size']))
+        return transport.Response(url, 404, {'Content-Type': 'text/html'},
+                                  b'<html><body>Not found</body></html>')
+
+    def _heavy_load(self, url):
+        return transport.Response(url, 503, {'Content-Type': 'text/html'},
+                                  HEAVY_LOAD_PAGE)
+
+    def _json(self, url, data):
+        body = json.dumps(data).encode('utf-8')
+        return transport.Response(url, 200, {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Content-Length': str(len(body))}, body)
+
+    def _xml(self, url, text):
+        body = text.encode('utf-8')
+        return transport.Response(url, 200, {
+            'Content-Type': 'application/xml; charset=utf-8',
+            'Content-Length': str(len(body))}, body)
+
+    def _file(self, url, path, body):
+        ext = path.rsplit('.', 1)[-1]
+        ctype = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif',
+                 'swf': 'application/x-shockwave-flash'}.get(ext,
+                 'application/octet-stream')
+        return transport.Response(url, 200, {
+            'Content-Type': ctype, 'Content-Length': str(len(body))}, body)
+
+    def _post_out(self, p, root):
+        """Returns post data as served, with absolute file URLs."""
+        p = dict(p)
+        for key in ('file_url', 'preview_url', 'sample_url'):
+            if p.get(key) and '://' not in p[key]: p[key] = root + p[key]
+        return p
+
+    # Pagination and search helpers
+
+    def _int(self, params, key, default=None):
+        try: return int(params[key])
+        except (KeyError, ValueError): return default
+
+    def _page(self, items, params, per_page):
+        page = max(1, self._int(params, 'page', 1))
+        return items[(page-1)*per_page:page*per_page]
+
+    def _history(self, items, params):
+        for key in ('post_id', 'user_id'):
+            if key in params:
+                value = self._int(params, key)
+                items = [h for h in items if h.get(key) == value]
+        before_id = self._int(params, 'before_id')
+        if before_id is not None:
+            items = [h for h in items if h['id'] < before_id]
+        limit = min(self._int(params, 'limit', HISTORY_PER_PAGE) or
+                    HISTORY_PER_PAGE, HISTORY_PER_PAGE)
+        return self._page(items, params, limit)
+
+    def _match_range(self, value, spec):
+        """Match a number against a metatag value such as >5, ..5 or 1..9."""
+        try:
+            if spec.startswith('>='): return value >= int(spec[2:])
+            if spec.startswith('<='): return value <= int(spec[2:])
+            if spec.startswith('>'): return value > int(spec[1:])
+            if spec.startswith('<'): return value < int(spec[1:])
+            if '..' in spec:
+                low, high = spec.split('..', 1)
+                return (not low or value >= int(low)) and \
+                    (not high or value <= int(high))
+            return value in [int(v) for v in spec.split(',')]
+        except ValueError:
+            return False
+
+    def _search(self, query):
+        """Returns posts matching a tag query, in the requested order."""
+        terms = query.split()
+        order = 'id'
+        filters = []
+        for term in terms:
+            negate = term.startswith('-')
+            if negate: term = term[1:]
+            name, sep, value = term.partition(':')
+            if sep and name == 'order':
+                order = value
+                continue
+            if sep and name in ('id', 'score', 'change'):
+                test = (lambda n, v: lambda p: self._match_range(p[n], v))(
+                    name, value)
+            elif sep and name == 'md5':
+                test = (lambda v: lambda p: p['md5'] in v)(
+                    set(value.lower().split(',')))
+            elif sep and name == 'rating':
+                test = (lambda v: lambda p: p['rating'] == v[0])(value)
+            elif sep and name == 'pool':
+                ids = set()
+                for pool in self.pools:
+                    if str(pool['id']) == value or pool['name'] == value:
+                        ids.update(pool['post_ids'])
+                test = (lambda ids: lambda p: p['id'] in ids)(ids)
+            else:
+                test = (lambda t: lambda p: t in p['tags'].split())(term)
+            filters.append((lambda t, n: lambda p: bool(t(p)) != n)(
+                test, negate))
+        result = [p for p in self.posts if all(f(p) for f in filters)]
+        if order in ('change', 'change_desc'):
+            result.sort(key=lambda p: p['change'], reverse=True)
+        elif order == 'change_asc':
+            result.sort(key=lambda p: p['change'])
+        elif order == 'id_asc':
+            result.reverse()
+        elif order == 'score':
+            result.sort(key=lambda p: p['score'], reverse=True)
+        return result
+
+    # Endpoints
+
+    def _post_index(self, params, root):
+        result = self._search(params.get('tags', ''))
+        before_id = self._int(params, 'before_id')
+        if before_id is not None:
+            result = [p for p in result if p['id'] < before_id]
+        limit = self._int(params, 'limit', 75)
+        limit = max(1, min(limit if limit is not None else 75,
+                           POSTS_PER_PAGE_MAX))
+        return [self._post_out(p, root)
+                for p in self._page(result, params, limit)]
+
+    def _post_index_xml(self, params, root):
+        # The XML listing also gives the total number of matching posts.
+        result = self._search(params.get('tags', ''))
+        limit = self._int(params, 'limit', 75)
+        limit = max(1, min(limit if limit is not None else 75,
+                           POSTS_PER_PAGE_MAX))
+        page = max(1, self._int(params, 'page', 1))
+        posts = ''.join('<post id="%d" md5=%s file_ext=%s/>' % (p['id'],
+                        quoteattr(p['md5']), quoteattr(p['file_ext']))
+                        for p in self._page(result, params, limit))
+        return '<?xml version="1.0" encoding="UTF-8"?>' +\
+            '<posts count="%d" offset="%d">%s</posts>' % (
+                len(result), (page-1)*limit, posts)
+
+    def _post_show(self, params, root):
+        post_id = self._int(params, 'id')
+        if post_id in self._posts_by_id:
+            return self._post_out(self._posts_by_id[post_id], root)
+        md5 = params.get('md5')
+        for p in self.posts:
+            if md5 and p['md5'] == md5: return self._post_out(p, root)
+        return {'success': False, 'reason': 'not found'}
+
+    def _post_popular(self, params, root):
+        result = sorted(self.posts, key=lambda p: p['score'], reverse=True)
+        return [self._post_out(p, root) for p in result[:32]]
+
+    def _favorite_list_users(self, params, root):
+        users = self.favorites.get(self._int(params, 'id'), [])
+        return {'favorited_users': ','.join(users)}
+
+    def _tag_history_index(self, params, root):
+        return self._history(self.tag_history, params)
+
+    def _flag_history_index(self, params, root):
+        return self._history(self.flag_history, params)
+
+    def _comment_index(self, params, root):
+        result = self.comments
+        if 'post_id' in params:
+            post_id = self._int(params, 'post_id')
+            result = [c for c in result if c['post_id'] == post_id]
+        return self._page(result, params, COMMENTS_PER_PAGE)
+
+    def _comment_show(self, params, root):
+        comment_id = self._int(params, 'id')
+        if comment_id in self._comments_by_id:
+            return self._comments_by_id[comment_id]
+        return {'success': False, 'reason': 'not found'}
+
+    def _user_index(self, params, root):
+        result = self.users
+        if 'id' in params:
+            user_id = self._int(params, 'id')
+            result = [u for u in result if u['id'] == user_id]
+        if 'name' in params:
+            result = [u for u in result if u['name'] == params['name']]
+        return self._page(result, params, 100)
+
+    def _tag_index(self, params, root):
+        result = self.tags
+        if 'id' in params:
+            tag_id = self._int(params, 'id')
+            result = [t for t in result if t['id'] == tag_id]
+        if 'name' in params:
+            result = [t for t in result if t['name'] == params['name']]
+        if params.get('order') == 'count':
+            result = sorted(result, key=lambda t: t['count'], reverse=True)
+        limit = self._int(params, 'limit', TAGS_PER_PAGE) or TAGS_PER_PAGE
+        return self._page(result, params, limit)
+
+    def _tag_related(self, params, root):
+        result = {}
+        for name in params.get('tags', '').split():
+            counts = {}
+            for p in self.posts:
+                tags = p['tags'].split()
+                if name in tags:
+                    for t in tags: counts[t] = counts.get(t, 0) + 1
+            related = sorted(counts.items(), key=lambda c: (-c[1], c[0]))
+            if name in counts:
+                related.remove((name, counts[name]))
+                related.insert(0, (name, counts[name]))
+            result[name] = [[t, str(c)] for t, c in related[:25]]
+        return result
+
+    def _pool_out(self, pool):
+        pool = dict(pool)
+        pool['post_count'] = len(pool.pop('post_ids'))
+        return pool
+
+    def _pool_index(self, params, root):
+        query = params.get('query', '')
+        result = [self._pool_out(p) for p in self.pools
+                  if query.lower() in p['name'].lower()]
+        result.sort(key=lambda p: p['updated_at']['s'], reverse=True)
+        return self._page(result, params, POOLS_PER_PAGE)
+
+    def _pool_show(self, params, root):
+        pool_id = self._int(params, 'id')
+        for pool in self.pools:
+            if pool['id'] == pool_id: break
+        else: return {'success': False, 'reason': 'not found'}
+        data = self._pool_out(pool)
+        posts = [self._posts_by_id[i] for i in pool['post_ids']
+                 if i in self._posts_by_id]
+        data['posts'] = [self._post_out(p, root) for p in
+                         self._page(posts, params, POOL_POSTS_PER_PAGE)]
+        return data
+
+    def _forum_index(self, params, root):
+        if 'parent_id' in params:
+            parent_id = self._int(params, 'parent_id')
+            result = [p for p in self.forum_posts
+                      if p.get('parent_id') == parent_id]
+        else:
+            result = [p for p in self.forum_posts
+                      if p.get('parent_id') is None]
+        return self._page(result, params, FORUM_POSTS_PER_PAGE)
+
+    def _forum_show(self, params, root):
+        post_id = self._int(params, 'id')
+        if post_id in self._forum_by_id: return self._forum_by_id[post_id]
+        return {'success': False, 'reason': 'not found'}
+
+    def _ticket_index(self, params, root):
+        return self._page(self.tickets, params, TICKETS_PER_PAGE)
+
+    def _ticket_show(self, params, root):
+        ticket_id = self._int(params, 'id')
+        for ticket in self.tickets:
+            if ticket['id'] == ticket_id: return ticket
+        return {'success': False, 'reason': 'not found'}
+
+
+class FakeTransport(transport.Transport):
+    def __init__(self, server):
+        """Create a transport that answers requests from a fake server
+        in-process, without opening any sockets.
+
+        :param server: The server to send requests to.
+        :type server: fakeserver.FakeServer
+        """
+        self.server = server
+
+    def get(self, url, headers=None, stream=False):
+        return self.server.handle('GET', url)
+
+    def post(self, url, data=None, headers=None):
+        return self.server.handle('POST', url, data)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (e.g. abandoned streams) are expected.
+        pass
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are sent separately, which Nagle's algorithm would
+    # hold back for the client's delayed ACK on every request.
+    disable_nagle_algorithm = True
+
+    def _respond(self, data=None):
+        response = self.server.fake.handle(
+            self.command, 'http://%s:%d%s' % (self.server.server_address[0],
+            self.server.server_address[1], self.path), data)
+        self.send_response(response.status_code)
+        for key, value in response.headers.items():
+            if key != 'content-length': self.send_header(key, value)
+        self.send_header('Content-Length', str(len(response.content)))
+        self.end_headers()
+        self.wfile.write(response.content)
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        self._respond(parse_qsl(body, keep_blank_values=True))
+
+    def log_message(self, format, *args):
+        pass
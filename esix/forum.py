@@ -5,6 +5,9 @@ Forum class for the e621 API.
 
 from . import api, config, errors
 
+# Replies returned per page of `forum/index.json`.
+REPLIES_PER_PAGE = 30
+
 def recent():
     """Return a generator of the 30 most recent forum threads.
 
@@ -111,7 +114,8 @@ class Post(object):
 
 class Thread(object):
     def __init__(self, thread_id=None, thread_data=None):
-        """Create an instance of a forum thread.
+        """Create an instance of a forum thread. Replies are not fetched
+        until they are used, and then only one page at a time.
 
         :param thread_id: The ID number of the thread to fetch online.
         :type thread_id: int
@@ -121,37 +125,62 @@ class Thread(object):
         """
         self._op = None
         self._replies = None
+        self._pages = {}
+        self._num_replies = None
         if thread_id is not None:
             # Get OP data
-            url = config.BASE_URL + 'forum/show.json?id=' + str(thread_id)
             try: self._op = Post(thread_id)
             except (errors.APIGetError, errors.JSONError):
                 raise errors.ForumPostNotFoundError('The requested forum ' +\
                     'thread could not be found.')
-            # Get replies data
-            self._load_replies()
+            self._num_replies = self._op.dump_data().get('response_count')
         if thread_data is not None:
             self._op = Post(post_data=thread_data)
+            self._num_replies = thread_data.get('response_count')
             if 'replies' in thread_data:
-                self._replies = []
-                for post_data in thread_data['replies']:
-                    self._replies.append(Post(post_data=post_data))
-                self._replies = list(reversed(self._replies))
+                self._replies = [Post(post_data=post_data) for post_data
+                                 in reversed(thread_data['replies'])]
+
+    def _get_page(self, page):
+        """Return a page of replies, newest first, fetching it if needed."""
+        if page not in self._pages:
+            url = config.BASE_URL + 'forum/index.json?parent_id=' +\
+                str(self.id) + '&page=' + str(page)
+            self._pages[page] = [Post(post_data=post_data)
+                                 for post_data in api._fetch_data(url)]
+        return self._pages[page]
+
+    def _count_replies(self):
+        """Count the replies by searching for the last page of the thread,
+        which takes a logarithmic number of requests."""
+        if len(self._get_page(1)) < REPLIES_PER_PAGE:
+            return len(self._get_page(1))
+        # Page `low` is always full and page `high` never is.
+        low, high = 1, 2
+        while len(self._get_page(high)) == REPLIES_PER_PAGE:
+            low, high = high, high * 2
+        while high - low > 1:
+            mid = (low + high) // 2
+            if len(self._get_page(mid)) == REPLIES_PER_PAGE: low = mid
+            else: high = mid
+        return low * REPLIES_PER_PAGE + len(self._get_page(high))
+
+    def _last_page(self):
+        """Return the number of the page holding the oldest replies. The
+        reply count is checked against the pages themselves, since replies
+        may have been added since the thread was loaded: if the last page
+        is full, more pages may follow."""
+        pages = max(1, (self.num_replies + REPLIES_PER_PAGE - 1) //
+                    REPLIES_PER_PAGE)
+        while len(self._get_page(pages)) == REPLIES_PER_PAGE: pages += 1
+        if pages > 1 and not self._get_page(pages): pages -= 1
+        self._num_replies = (pages - 1) * REPLIES_PER_PAGE + \
+            len(self._get_page(pages))
+        return pages
 
     def _load_replies(self):
         """Load all replies to this thread into a list"""
-        url = config.BASE_URL + 'forum/index.json?parent_id=' + str(self.id)
-        self._replies = []
-        page = 1
-        end = False
-        while not end:
-            rs = api._fetch_data(url + '&page=' + str(page))
-            for post_data in rs: self._replies.append(Post(post_data=post_data))
-            if rs is None or len(rs) == 0:
-                end = True
-                break
-            page += 1
-        self._replies = list(reversed(self._replies))
+        self._replies = list(self.iter_replies())
 
     @property
     def id(self):
@@ -196,8 +225,10 @@ class Thread(object):
     @property
     def num_replies(self):
         """Return the number of replies the thread has (excluding the OP)."""
-        if self._replies is None: self._load_replies()
-        return len(self._replies)
+        if self._replies is not None: return len(self._replies)
+        if self._num_replies is None:
+            self._num_replies = self._count_replies()
+        return self._num_replies
 
     @property
     def url(self):
@@ -206,27 +237,55 @@ class Thread(object):
     
     @property
     def replies(self):
-        """Return a generator of replies in the thread."""
-        if self._replies is None:
-            yield None
+        """Return a generator of replies in the thread, oldest first."""
+        return self.iter_replies()
+
+    def iter_replies(self, reverse=False):
+        """Return a generator of replies in the thread, fetching each page
+        of replies as it is reached.
+
+        :param reverse: If True, return the newest replies first.
+        :type reverse: bool
+        :returns: A generator of forum posts.
+        :rtype: generator object
+        """
+        if self._replies is not None:
+            for r in (reversed(self._replies) if reverse else self._replies):
+                yield r
             return
-        for r in self._replies:
-            yield r
+        if reverse:
+            page = 1
+            while True:
+                rs = self._get_page(page)
+                for r in rs: yield r
+                if len(rs) < REPLIES_PER_PAGE: return
+                page += 1
+        for page in range(self._last_page(), 0, -1):
+            for r in reversed(self._get_page(page)): yield r
 
     def get_reply(self, index):
-        """Return the given reply by index, None if it does not exist."""
+        """Return the given reply by index, None if it does not exist.
+        Only the page holding the reply is fetched."""
         if index == 0: return self._op
-        if self._replies is None: return None
-        try: return self._replies[index-1]
-        except: return None
+        if self._replies is not None:
+            try: return self._replies[index-1]
+            except: return None
+        if index < 0: return None
+        self._last_page()
+        if index > self.num_replies: return None
+        position = self.num_replies - index
+        page = self._get_page(position // REPLIES_PER_PAGE + 1)
+        try: return page[position % REPLIES_PER_PAGE]
+        except IndexError: return None
 
     def dump_data(self):
-        """Returns a dict of all data stored locally for this object.
-        This does not include replies if they have not been loaded.
+        """Returns a dict of all data for this object, including every
+        reply. Replies not loaded yet are fetched first.
 
-        :returns: All locally-stored forum thread data.
+        :returns: All forum thread data.
         :rtype: dict
         """
+        if self._replies is None: self._load_replies()
         return dict(self._op.dump_data(), **{
-            'replies':[r.dump_data() for r in self.replies]
+            'replies':[r.dump_data() for r in self._replies]
         })
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Durable queue of post downloads, shared by workers on one or more machines.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+from . import errors, post
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY, post_id INTEGER NOT NULL, dest TEXT NOT NULL,
+    data TEXT, state TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0, lease TEXT, owner TEXT,
+    expires REAL, error TEXT, updated REAL NOT NULL,
+    UNIQUE (post_id, dest)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, expires, id);
+'''
+
+READY = 'ready'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job(object):
+    def __init__(self, queue, row):
+        """A leased download. Created by `JobQueue.lease`."""
+        self.queue = queue
+        self.id, self.post_id, self.dest, data, self.attempts, \
+            self.lease = row
+        self._data = json.loads(data) if data else None
+
+    def post(self):
+        """Returns the post to download, fetching it if it was queued by ID.
+
+        :rtype: post.Post
+        """
+        if self._data is None: return post.Post(self.post_id)
+        return post.Post(post_data=dict(self._data))
+
+    def ack(self):
+        """Mark the job done. See `JobQueue.ack`."""
+        return self.queue.ack(self)
+
+    def fail(self, error=None):
+        """Give the job back. See `JobQueue.fail`."""
+        return self.queue.fail(self, error)
+
+
+class JobQueue(object):
+    def __init__(self, path, visibility_timeout=300, max_attempts=5):
+        """Create or open a queue of post downloads. The queue is a SQLite
+        file, so workers on several machines can share it on a network
+        drive. A leased job is hidden from other workers until it is
+        acknowledged, failed or its lease runs out, so a job is only
+        downloaded again if its worker stopped without finishing it.
+
+        :param path: The SQLite database file.
+        :type path: str
+        :param visibility_timeout: Seconds a lease lasts by default.
+        :type visibility_timeout: float
+        :param max_attempts: Leases per job before it is marked failed.
+        :type max_attempts: int
+        """
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        # No write-ahead log: it needs shared memory, which network drives
+        # do not provide.
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self, func):
+        """Run a function in a transaction that holds the write lock from
+        the start, so two workers cannot lease the same job."""
+        self._db.execute('BEGIN IMMEDIATE')
+        try: result = func()
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        return result
+
+    def enqueue(self, posts, dest=''):
+        """Add post downloads to the queue. Posts already queued for the
+        same folder are skipped.
+
+        :param posts: Posts (e.g. from `post.search` or `Pool.posts`) or
+            post IDs. Posts are stored with their data, so workers do not
+            need to fetch them again.
+        :type posts: iterable
+        :param dest: The folder the posts are downloaded to.
+        :type dest: str
+        :returns: The number of jobs added.
+        :rtype: int
+        :raises: errors.PoolError if a page of posts failed to load (e.g.
+            `Pool.iter_posts` yielded None). Nothing is queued then.
+        """
+        if dest != '' and not dest.endswith('/'): dest += '/'
+        rows = []
+        for p in posts:
+            if p is None:
+                raise errors.PoolError('A page of posts failed to load.')
+            if isinstance(p, post.Post):
+                rows.append((p.id, dest, json.dumps(p.dump_data())))
+            else: rows.append((int(p), dest, None))
+        now = time.time()
+        def insert():
+            added = 0
+            for row in rows:
+                added += self._db.execute(
+                    'INSERT OR IGNORE INTO jobs (post_id, dest, data, '
+                    'updated) VALUES (?, ?, ?, ?)', row + (now,)).rowcount
+            return added
+        return self._transaction(insert)
+
+    def lease(self, count=1, owner=None, timeout=None):
+        """Take jobs from the queue, oldest first. Jobs whose lease ran out
+        are taken again.
+
+        :param count: The most jobs to take.
+        :type count: int
+        :param owner: A name for the worker, kept with the job. Default is the
+            host name and process ID.
+        :type owner: str
+        :param timeout: Seconds until the lease runs out. Default is the
+            queue's visibility timeout.
+        :type timeout: float
+        :returns: The leased jobs.
+        :rtype: list
+        """
+        owner = owner or socket.gethostname() + ':' + str(os.getpid())
+        timeout = self.visibility_timeout if timeout is None else timeout
+        def take():
+            now = time.time()
+            # Jobs out of attempts are failed rather than leased again.
+            self._db.execute(
+                "UPDATE jobs SET state = ?, updated = ? WHERE state = ? AND "
+                "expires <= ? AND attempts >= ?",
+                (FAILED, now, LEASED, now, self.max_attempts))
+            ids = [row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE state = ? OR (state = ? AND "
+                "expires <= ?) ORDER BY id LIMIT ?",
+                (READY, LEASED, now, count))]
+            jobs = []
+            for job_id in ids:
+                lease = uuid.uuid4().hex
+                self._db.execute(
+                    'UPDATE jobs SET state = ?, attempts = attempts + 1, '
+                    'lease = ?, owner = ?, expires = ?, updated = ? '
+                    'WHERE id = ?',
+                    (LEASED, lease, owner, now + timeout, now, job_id))
+                jobs.append(Job(self, self._db.execute(
+                    'SELECT id, post_id, dest, data, attempts, lease FROM '
+                    'jobs WHERE id = ?', (job_id,)).fetchone()))
+            return jobs
+        return self._transaction(take)
+
+    def _settle(self, job, state, error=None):
+        def update():
+            return self._db.execute(
+                'UPDATE jobs SET state = ?, error = ?, lease = NULL, '
+                'expires = NULL, updated = ? WHERE id = ? AND lease = ?',
+                (state, error, time.time(), job.id, job.lease)).rowcount
+        return bool(self._transaction(update))
+
+    def ack(self, job):
+        """Mark a leased job done.
+
+        :param job: The job.
+        :type job: jobqueue.Job
+        :returns: False if the lease had run out and the job was leased by
+            another worker.
+        :rtype: bool
+        """
+        return self._settle(job, DONE)
+
+    def fail(self, job, error=None):
+        """Give a leased job back to be tried again, or mark it failed if
+        it is out of attempts.
+
+        :param job: The job.
+        :type job: jobqueue.Job
+        :param error: A description of what went wrong.
+        :type error: str
+        :returns: False if the lease had run out and the job was leased by
+            another worker.
+        :rtype: bool
+        """
+        state = FAILED if job.attempts >= self.max_attempts else READY
+        return self._settle(job, state, None if error is None else str(error))
+
+    def extend(self, job, timeout=None):
+        """Lengthen a job's lease, e.g. during a long download.
+
+        :param job: The job.
+        :type job: jobqueue.Job
+        :param timeout: Seconds from now until the lease runs out. Default
+            is the queue's visibility timeout.
+        :type timeout: float
+        :returns: False if the lease had already run out and the job was
+            leased by another worker.
+        :rtype: bool
+        """
+        timeout = self.visibility_timeout if timeout is None else timeout
+        def update():
+            return self._db.execute(
+                'UPDATE jobs SET expires = ?, updated = ? WHERE id = ? AND '
+                'lease = ?', (time.time() + timeout, time.time(), job.id,
+                              job.lease)).rowcount
+        return bool(self._transaction(update))
+
+    def counts(self):
+        """Returns the number of jobs in each state: 'ready', 'leased',
+        'done' and 'failed'.
+
+        :rtype: dict
+        """
+        result = dict((state, 0) for state in (READY, LEASED, DONE, FAILED))
+        for state, count in self._db.execute(
+                'SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+            result[state] = count
+        return result
+
+    def failed(self):
+        """Returns the failed jobs' post IDs, folders and errors.
+
+        :rtype: list
+        """
+        return self._db.execute('SELECT post_id, dest, error FROM jobs WHERE '
+                                'state = ? ORDER BY id', (FAILED,)).fetchall()
+
+    def retry_failed(self):
+        """Put failed jobs back in the queue with their attempts reset.
+
+        :returns: The number of jobs put back.
+        :rtype: int
+        """
+        return self._transaction(lambda: self._db.execute(
+            'UPDATE jobs SET state = ?, attempts = 0, updated = ? WHERE '
+            'state = ?', (READY, time.time(), FAILED)).rowcount)
+
+
+class Worker(object):
+    def __init__(self, queue, owner=None, batch=10,
+                 name_format='{md5}.{file_ext}'):
+        """Create a worker that downloads the posts in a queue.
+
+        :param queue: The queue to work from.
+        :type queue: jobqueue.JobQueue
+        :param owner: The worker's name. Default is the host name and
+            process ID.
+        :type owner: str
+        :param batch: The number of jobs leased at once.
+        :type batch: int
+        :param name_format: The file name format, as for `Post.download`.
+        :type name_format: str
+        """
+        self.queue = queue
+        self.owner = owner or socket.gethostname() + ':' + str(os.getpid())
+        self.batch = batch
+        self.name_format = name_format
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.lost = 0
+
+    def process(self, job):
+        """Download a job's post, unless its file already exists. The file
+        is written to a hidden folder first and moved into place once
+        complete, so other machines never see a partial file.
+
+        :param job: The job.
+        :type job: jobqueue.Job
+        :returns: Whether the post was downloaded (False if it existed).
+        :rtype: bool
+        :raises: errors.BadPostError, errors.FileDownloadError
+        """
+        p = job.post()
+        name = self.name_format.replace('{', '%(').replace('}', ')s') % \
+            p.dump_data()
+        if not name.endswith('.' + p.file_ext): name += '.' + p.file_ext
+        if os.path.isfile(job.dest + name): return False
+        partial = job.dest + '.partial/' + self.owner.replace(':', '-') + '/'
+        if not p.download(partial, self.name_format, overwrite=True):
+            raise errors.FileDownloadError('The post could not be ' +\
+                'downloaded.')
+        os.replace(partial + name, job.dest + name)
+        return True
+
+    def run_once(self):
+        """Lease and work through one batch of jobs. Each job's lease is
+        renewed just before it is worked on, so jobs late in the batch do
+        not run out while earlier ones download. Jobs whose lease ran out
+        anyway, and were taken by another worker, are counted in `lost`.
+
+        :returns: The number of jobs leased.
+        :rtype: int
+        """
+        jobs = self.queue.lease(self.batch, self.owner)
+        for job in jobs:
+            if not self.queue.extend(job):
+                self.lost += 1
+                continue
+            try: downloaded = self.process(job)
+            except Exception as e:
+                if job.fail(e): self.failed += 1
+                else: self.lost += 1
+                continue
+            if not job.ack(): self.lost += 1
+            elif downloaded: self.downloaded += 1
+            else: self.skipped += 1
+        return len(jobs)
+
+    def run(self, wait=False, poll_interval=10):
+        """Work until the queue is empty.
+
+        :param wait: If True, keep waiting for new jobs instead of stopping
+            once the queue is empty.
+        :type wait: bool
+        :param poll_interval: Seconds between checks for new jobs.
+        :type poll_interval: float
+        """
+        while True:
+            if self.run_once(): continue
+            counts = self.queue.counts()
+            if not wait and not counts[READY] and not counts[LEASED]: return
+            time.sleep(poll_interval)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Incremental parsing of JSON arrays, for handling pages as they download.
+"""
+
+import json
+import re
+
+# Characters that matter outside and inside of JSON strings.
+_STRUCTURE = re.compile(b'["\\[\\]{},]')
+_STRING_END = re.compile(b'["\\\\]')
+_SKIP = b' \t\r\n,'
+
+
+class ArrayParser(object):
+    def __init__(self, loads=None):
+        """Create a parser for a top-level JSON array that is fed bytes a
+        chunk at a time and returns each element once it is complete.
+        Only the element currently being read is kept in memory.
+
+        :param loads: The function used to decode each element.
+            Default is `json.loads`.
+        :type loads: function
+        """
+        self.loads = loads or json.loads
+        self.done = False
+        self._buf = b''
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._begun = False
+
+    def feed(self, data):
+        """Parse another chunk of the document.
+
+        :param data: The next chunk of UTF-8 encoded JSON.
+        :type data: bytes
+        :returns: The elements completed by this chunk.
+        :rtype: list
+        :raises: ValueError
+        """
+        buf = self._buf + data
+        pos, n = self._pos, len(buf)
+        items = []
+        while pos < n and not self.done:
+            if self._in_string:
+                m = _STRING_END.search(buf, pos)
+                if m is None:
+                    pos = n
+                elif buf[m.start():m.end()] == b'\\':
+                    # Wait for the escaped character if it is not here yet.
+                    if m.end() >= n:
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                else:
+                    self._in_string = False
+                    pos = m.end()
+                continue
+            if not self._begun:
+                while pos < n and buf[pos:pos+1] in b' \t\r\n': pos += 1
+                if pos == n: break
+                if buf[pos:pos+1] != b'[':
+                    raise ValueError('The document is not a JSON array.')
+                self._begun = True
+                self._depth = 1
+                pos += 1
+                continue
+            if self._depth == 1 and self._start is None:
+                while pos < n and buf[pos:pos+1] in _SKIP: pos += 1
+                if pos == n: break
+                if buf[pos:pos+1] == b']':
+                    self.done = True
+                    pos += 1
+                    break
+                self._start = pos
+            m = _STRUCTURE.search(buf, pos)
+            if m is None:
+                pos = n
+                break
+            c, pos = buf[m.start():m.end()], m.end()
+            if c == b'"':
+                self._in_string = True
+            elif c in b'[{':
+                self._depth += 1
+            elif c in b']}':
+                self._depth -= 1
+                if self._depth == 1:
+                    items.append(self.loads(buf[self._start:pos]))
+                    self._start = None
+                elif self._depth == 0:
+                    # The array ended right after a bare value.
+                    items.append(self.loads(buf[self._start:m.start()]))
+                    self._start = None
+                    self.done = True
+            elif self._depth == 1:
+                # A comma ends a bare value such as a number or string.
+                items.append(self.loads(buf[self._start:m.start()]))
+                self._start = None
+        keep = pos if self._start is None else self._start
+        self._buf, self._pos = buf[keep:], pos - keep
+        if self._start is not None: self._start = 0
+        return items
+
+    def close(self):
+        """Signal the end of the document.
+
+        :raises: ValueError
+        """
+        if not self.done:
+            raise ValueError('The JSON array was not terminated.')
+
+
+def iter_array(chunks, loads=None):
+    """Decode the elements of a JSON array from a stream of chunks.
+
+    :param chunks: An iterable of UTF-8 encoded byte chunks.
+    :type chunks: iterable
+    :param loads: The function used to decode each element.
+    :type loads: function
+    :returns: A generator of the array's elements.
+    :rtype: generator object
+    :raises: ValueError
+    """
+    parser = ArrayParser(loads)
+    for chunk in chunks:
+        for item in parser.feed(chunk): yield item
+    parser.close()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Incremental refresh of locally stored post metadata, driven by each post's
+change counter.
+"""
+
+import json
+import os
+
+from . import comment, post
+
+FILE_CHANGES = '.changes'
+
+
+class MetadataSync(object):
+    def __init__(self, dest):
+        """Track the `change` value of every post whose metadata is stored
+        in a folder, so unchanged posts are never rewritten.
+
+        :param dest: The metadata folder, as passed to
+            `Post.download_metadata`.
+        :type dest: str
+        """
+        if dest != './' and not dest.endswith('/'): dest += '/'
+        self.dest = dest
+        self.posts = {}
+        self.high = None
+        if os.path.isfile(dest + FILE_CHANGES):
+            with open(dest + FILE_CHANGES) as f: state = json.load(f)
+            self.posts = state['posts']
+            self.high = state['high']
+
+    def save(self):
+        """Write the recorded change values to disk."""
+        if not os.path.isdir(self.dest): os.makedirs(self.dest)
+        path = self.dest + FILE_CHANGES
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'posts': self.posts, 'high': self.high}, f)
+        os.replace(path + '.tmp', path)
+
+    def _stored(self, p):
+        """Returns the recorded entry for a post. Posts stored before
+        syncing was used are read from their metadata file once."""
+        key = str(p.id)
+        if key not in self.posts and p.md5 and \
+                os.path.isfile(self.dest + p.md5):
+            try:
+                with open(self.dest + p.md5) as f: data = json.load(f)
+                self.posts[key] = {'change': data.get('change'),
+                                   'md5': data.get('md5')}
+            except (IOError, ValueError): pass
+        return self.posts.get(key)
+
+    def needs_update(self, p):
+        """Returns whether a post changed since its metadata was written.
+
+        :param p: The post, with its current data.
+        :type p: post.Post
+        :rtype: bool
+        """
+        entry = self._stored(p)
+        return entry is None or entry['change'] is None or \
+            p.change is None or p.change > entry['change']
+
+    def _changed_fields(self, p):
+        """Returns the fields that differ from the stored metadata file."""
+        try:
+            with open(self.dest + p.md5) as f: old = json.load(f)
+        except (IOError, ValueError, TypeError): return None
+        new = p.dump_data()
+        return sorted(k for k in set(old) | set(new)
+                      if k != 'comments' and old.get(k) != new.get(k))
+
+    def _record(self, p):
+        self.posts[str(p.id)] = {'change': p.change, 'md5': p.md5}
+
+    def write_many(self, posts, comments=False, pretty=False, workers=None):
+        """Write metadata for the given posts that changed, skipping the
+        rest without touching the disk.
+
+        :param posts: The posts, with their current data.
+        :type posts: list
+        :param comments: Whether or not to store the posts' comments.
+        :type comments: bool
+        :param pretty: Whether or not to pretty print the files.
+        :type pretty: bool
+        :param workers: The most posts whose comments are fetched at once.
+        :type workers: int
+        :returns: A dict of post ID to None if unchanged, or else to a list
+            of the fields that changed (empty for new posts) or False if
+            writing failed.
+        :rtype: dict
+        """
+        changed = [p for p in posts if self.needs_update(p)]
+        result = dict((p.id, None) for p in posts)
+        fields = dict((p.id, self._changed_fields(p) or []) for p in changed)
+        post_comments = comment.for_posts(changed, workers) \
+            if comments and changed else {}
+        for p in changed:
+            if comments and p.id not in post_comments:
+                result[p.id] = False
+            elif p.download_metadata(self.dest, comments, pretty,
+                                     post_comments.get(p.id)):
+                self._record(p)
+                result[p.id] = fields[p.id]
+            else: result[p.id] = False
+        return result
+
+    def refresh(self, query='', comments=False, pretty=False, workers=None,
+                batch_size=100):
+        """Rewrite the metadata of stored posts that changed since the last
+        refresh. Posts are listed most recently changed first, and listing
+        stops at the first post no newer than the newest change seen by the
+        previous refresh, so an unchanged archive costs a single request.
+        Before the first refresh, listing stops below the oldest change
+        recorded by `write_many`, as any stored post that changed since is
+        newer than that.
+
+        :param query: Only check posts matching this tag query.
+        :type query: str
+        :param comments: Whether or not to store the posts' comments.
+        :type comments: bool
+        :param pretty: Whether or not to pretty print the files.
+        :type pretty: bool
+        :param workers: The most posts whose comments are fetched at once.
+        :type workers: int
+        :param batch_size: Posts written per batch of comment requests.
+        :type batch_size: int
+        :returns: A dict of post ID to the list of fields that changed, for
+            each stored post that was rewritten.
+        :rtype: dict
+        """
+        high = self.high
+        changes = [entry['change'] for entry in self.posts.values()]
+        if high is None and changes and None not in changes:
+            high = min(changes)
+        top = None
+        report = {}
+        batch = []
+        def flush():
+            for post_id, fields in self.write_many(batch, comments, pretty,
+                                                   workers).items():
+                if fields is not None: report[post_id] = fields
+            del batch[:]
+        for p in post.search((query + ' order:change').strip(), 0,
+                             stream=True):
+            if high is not None and p.change is not None and p.change <= high:
+                break
+            if top is None: top = p.change
+            if self._stored(p) is None: continue
+            batch.append(p)
+            if len(batch) >= batch_size: flush()
+        if batch: flush()
+        if top is not None: self.high = top
+        self.save()
+        return report
@@ -3,8 +3,14 @@
 Pool class for the e621 API.
 """
 
+import json
+import os
+
 from . import api, config, errors, post
 
+# Posts returned per page of `pool/show.json`.
+POSTS_PER_PAGE = 24
+
 def search(title='', limit=5):
     """Search the site's image pools by name.
 
@@ -42,6 +48,64 @@ def recent():
         yield Pool(pool_data=pool_data)
 
 
+def updated_since(when, limit=None):
+    """Walk the pool list, most recently updated first, returning pools
+    updated after the given time. Each request returns 20 pools, so this is
+    the cheapest way to find changes across many pools.
+
+    :param when: The `updated_at` value of the last check.
+    :type when: dict or int
+    :param limit: The highest number of pages to fetch. Default no limit.
+    :type limit: int
+    :returns: A generator of pools updated since then.
+    :rtype: generator object
+    """
+    url = config.BASE_URL + 'pool/index.json?query='
+    page = 1
+    while not limit or page <= limit:
+        rs = api._fetch_data(url + '&page=' + str(page))
+        if not rs: return
+        for pool_data in rs:
+            if _time_key(pool_data.get('updated_at')) <= _time_key(when):
+                return
+            yield Pool(pool_data=pool_data)
+        page += 1
+
+def fetch_many(pool_ids, workers=None):
+    """Load the details of many pools at once, without any of their posts.
+
+    :param pool_ids: The ID numbers of the pools to load.
+    :type pool_ids: list
+    :param workers: The most requests in flight at once.
+        Default is `config.MAX_WORKERS`.
+    :type workers: int
+    :returns: A dict of pool ID to pool. Pools that could not be found or
+        loaded are left out.
+    :rtype: dict
+    """
+    pool_ids = list(pool_ids)
+    pools = {}
+    for pool_id, data in zip(pool_ids, api._fetch_many(
+            [_metadata_url(pool_id) for pool_id in pool_ids], workers,
+            skip_errors=True)):
+        if isinstance(data, dict) and 'id' in data:
+            data.pop('posts', None)
+            pools[pool_id] = Pool(pool_data=data)
+    return pools
+
+def _metadata_url(pool_id):
+    """Returns a URL for a pool's details. The page is past the end of any
+    pool, so no post data comes back with it."""
+    return config.BASE_URL + 'pool/show.json?id=' + str(pool_id) +\
+        '&page=999'
+
+def _time_key(value):
+    """Returns a sortable form of a timestamp from the API."""
+    if isinstance(value, dict): return (value.get('s', 0), value.get('n', 0))
+    if value is None: return (0, 0)
+    return (value, 0)
+
+
 class Pool(object):
     def __init__(self, pool_id=None, pool_data=None):
         """Create an instance of a pool.
@@ -58,14 +122,13 @@ class Pool(object):
                      'is_active', 'description']:
             self._data[prop] = None
         if pool_id is not None:
-            url = config.BASE_URL + 'pool/show.json?id=' + str(pool_id)
             try:
-                data = api._fetch_data(url + '&page=999')
+                data = api._fetch_data(_metadata_url(pool_id))
+                data.pop('posts', None)
                 for prop in data: self._data[prop] = data[prop]
             except (errors.APIGetError, errors.JSONError):
                 raise errors.PoolNotFoundError('The requested pool could ' +\
                     'not be found.')
-            if 'posts' in data: del(data['posts'])
         if pool_data is not None:
             for prop in pool_data: self._data[prop] = pool_data[prop]
 
@@ -155,11 +218,50 @@ class Pool(object):
     @property
     def posts(self):
         """Returns a generator of Post objects for the pool."""
+        return self.iter_posts()
+
+    def iter_posts(self, parallel=False, workers=None):
+        """Returns a generator of Post objects for the pool, in pool order.
+
+        :param parallel: If True, use the pool's post count to work out how
+            many pages there are and fetch them all at once, rather than
+            one after another until an empty page is found. Posts added
+            after the count was loaded may be missed if the old count was
+            a multiple of 24; load the pool again to be sure.
+        :type parallel: bool
+        :param workers: The most pages fetched at once when parallel.
+            Default is `config.MAX_WORKERS`.
+        :type workers: int
+        :returns: A generator of posts, or None if a page failed to load.
+        :rtype: generator object
+        """
         url = config.BASE_URL + 'pool/show.json?id=' + str(self.id)
         page = 1
+        level = api.get_priority(api.BULK)
+        if parallel:
+            if self.post_count is None:
+                self.post_count = Pool(self.id).post_count
+            expected = int(self.post_count or 0)
+            pages = (expected + POSTS_PER_PAGE - 1) // POSTS_PER_PAGE
+            count = 0
+            try:
+                for rs in api._fetch_many([url + '&page=' + str(page)
+                        for page in range(1, pages+1)], workers, level):
+                    for post_data in rs['posts']:
+                        count += 1
+                        yield post.Post(post_data=post_data)
+            except (errors.APIGetError, errors.JSONError):
+                yield None
+                return
+            # Keep looking only if the pages held more posts than the count,
+            # i.e. the pool grew since it was loaded. Growth is missed when
+            # the old count filled its last page exactly, as that page then
+            # comes back full either way.
+            if count <= expected or len(rs['posts']) < POSTS_PER_PAGE: return
+            page = pages + 1
         end = False
         while not end:
-            try: rs = api._fetch_data(url + '&page=' + str(page))
+            try: rs = api._fetch_data(url + '&page=' + str(page), level)
             except (errors.APIGetError, errors.JSONError):
                 yield None
                 return
@@ -178,3 +280,103 @@ class Pool(object):
         :rtype: dict
         """
         return self._data
+
+
+class PoolIndex(object):
+    def __init__(self, path=None):
+        """Create a local index of the posts in pools, in pool order.
+        A pool's post list is only fetched again once its details show it
+        has changed.
+
+        :param path: A JSON file to load the index from and save it to.
+            If None, the index is only kept in memory.
+        :type path: str
+        """
+        self.path = path
+        self._pools = {}
+        if path and os.path.isfile(path):
+            with open(path) as f: self._pools = json.load(f)
+
+    def _key(self, pool_id):
+        return str(pool_id)
+
+    def is_current(self, pool):
+        """Returns whether the stored post list is up to date for a pool.
+
+        :param pool: The pool's current details.
+        :type pool: pool.Pool
+        :rtype: bool
+        """
+        entry = self._pools.get(self._key(pool.id))
+        return entry is not None and \
+            entry['updated_at'] == pool.updated_at and \
+            entry['post_count'] == pool.post_count
+
+    def check(self, pools, workers=None):
+        """Find which pools have changed since they were indexed. Only pool
+        details are fetched, never posts.
+
+        :param pools: Pool ID numbers, or pools already loaded (for example
+            from `pool.search` or `pool.updated_since`).
+        :type pools: list
+        :param workers: The most requests in flight at once.
+        :type workers: int
+        :returns: The pools whose post lists are out of date. Pools whose
+            details could not be loaded are left out.
+        :rtype: list
+        """
+        pools = list(pools)
+        ids = [p for p in pools if not isinstance(p, Pool)]
+        loaded = fetch_many(ids, workers) if ids else {}
+        result = []
+        for p in pools:
+            if not isinstance(p, Pool):
+                p = loaded.get(p)
+                if p is None: continue
+            if not self.is_current(p): result.append(p)
+        return result
+
+    def post_ids(self, pool, parallel=True):
+        """Returns the IDs of a pool's posts in pool order, fetching them
+        only if the pool changed since it was last indexed.
+
+        :param pool: The pool, or its ID number.
+        :type pool: pool.Pool or int
+        :param parallel: Whether to fetch all pages of the pool at once.
+        :type parallel: bool
+        :rtype: list
+        """
+        if not isinstance(pool, Pool): pool = Pool(pool)
+        if not self.is_current(pool): self.update(pool, parallel)
+        return list(self._pools[self._key(pool.id)]['post_ids'])
+
+    def update(self, pool, parallel=True):
+        """Fetch and store a pool's post list.
+
+        :param pool: The pool to index.
+        :type pool: pool.Pool
+        :param parallel: Whether to fetch all pages of the pool at once.
+        :type parallel: bool
+        :raises: errors.PoolError
+        """
+        ids = []
+        for p in pool.iter_posts(parallel=parallel):
+            if p is None:
+                raise errors.PoolError('Failed to load the posts of pool ' +\
+                    str(pool.id) + '.')
+            ids.append(p.id)
+        self._pools[self._key(pool.id)] = {
+            'updated_at': pool.updated_at,
+            'post_count': pool.post_count,
+            'post_ids': ids
+        }
+
+    def save(self, path=None):
+        """Write the index to disk.
+
+        :param path: The file to write. Default is the index's path.
+        :type path: str
+        """
+        path = path or self.path
+        with open(path + '.tmp', 'w') as f: json.dump(self._pools, f)
+        os.replace(path + '.tmp', path)
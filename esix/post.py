@@ -3,52 +3,269 @@
 Post class for the e621 API.
 """
 
+import contextlib
 import hashlib
 import json
 import os
+import time
+import xml.etree.ElementTree
 
 from . import api, config, errors, comment, user
 
 
+# The most posts the site returns in a single request.
+MAX_LIMIT = 320
+# The most md5s looked up in a single search.
+MD5_BATCH_SIZE = 100
+
+
 def recent(limit=75):
     """Fetch the most recent posts from the site.
 
-    :param limit: The number of posts to fetch, up to 100. Default 75.
+    :param limit: The number of posts to fetch, up to 320. Default 75.
     :type limit: int
     :returns: A generator of the most recent posts.
     :rtype: generator object
     """
+    try: limit = min(int(limit), MAX_LIMIT)
+    except: limit = 75
+    if not limit > 0: limit = 75
     url = config.BASE_URL + 'post/index.json?limit=' + str(limit)
     for post_data in api._fetch_data(url):
         yield Post(post_data=post_data)
 
-def search(query, limit=75):
+def count(query):
+    """Returns the number of posts matching a query. The count is read from
+    the site's XML listing in a single request. If the count is not there,
+    the results are counted a page at a time instead.
+
+    :param query: The tag search query.
+    :type query: str
+    :rtype: int
+    :raises: errors.SiteLoadError
+    """
+    page = api._get_page(config.BASE_URL + 'post/index.xml?tags=' +
+                         str(query) + '&limit=1')
+    content = getattr(page, 'content', b'')
+    try: return int(xml.etree.ElementTree.fromstring(content).get('count'))
+    except (xml.etree.ElementTree.ParseError, TypeError, ValueError):
+        if b'This website is under heavy load' in \
+                content[:api.HEAVY_LOAD_SCAN_BYTES]:
+            raise errors.SiteLoadError('API call failed. ' +\
+                'The site is under heavy load.')
+    return sum(1 for p in search(query, 0, stream=True))
+
+def search(query, limit=75, stream=False, cache=None, before_id=None):
     """Run a search and return a list of the resulting images.
 
     :param query: The tag search query.
     :type query: str
-    :param limit: Number of posts to fetch. Default 75.
+    :param limit: Number of posts to fetch, 0 for all. Default 75.
     :type limit: int
+    :param stream: If True, each post is returned as soon as it has been
+        downloaded, rather than once its whole page has been.
+    :type stream: bool
+    :param cache: Answer the search from this cache, only fetching posts
+        newer than those already cached.
+    :type cache: post.SearchCache
+    :param before_id: Only return posts with a lower ID than this, e.g. to
+        continue an earlier search from its last post.
+    :type before_id: int
     :returns: A generator of images matching the query.
     :rtype: generator object
     """
-    try: limit = int(limit)
-    except: limit = 75
-    if not limit >= 0: limit = 75
-    url = config.BASE_URL + 'post/index.json?tags=' + str(query) +\
-        '&limit=' + (str(limit) if limit > 0 else '100')
-    result = 0
-    page = 1
-    end = False
-    while not end:
-        rs = api._fetch_data(url + '&page=' + str(page))
-        result += len(rs)
-        for post_data in rs:
+    if cache is not None:
+        for p in cache.search(query, limit): yield p
+        return
+    plan = SearchPlan(query, limit, before_id)
+    fetch = api._stream_data if stream else api._fetch_data
+    # Paging through results is bulk traffic unless the caller says not.
+    level = api.get_priority(api.BULK)
+    fetched = 0
+    last_id = None
+    while True:
+        request = plan.next_request(fetched, last_id)
+        if request is None: break
+        url, size = request
+        count = 0
+        for post_data in fetch(url, level):
+            if plan.limit and fetched + count >= plan.limit: break
+            count += 1
+            last_id = post_data['id']
             yield Post(post_data=post_data)
-        if rs is None or len(rs) == 0 or (limit and result >= limit):
-            end = True
-            break
-        page += 1
+        fetched += count
+        if count < size: break
+
+class SearchPlan(object):
+    def __init__(self, query, limit=75, before_id=None):
+        """Work out the requests a search needs. Pages are as large as the
+        site allows and the last page only asks for the posts still needed.
+        Searches in the default (newest first) order page with `before_id`
+        from the last post received, so no page is fetched twice. Searches
+        with an `order:` tag use page numbers.
+
+        :param query: The tag search query.
+        :type query: str
+        :param limit: Number of posts to fetch, 0 for all. Default 75.
+        :type limit: int
+        :param before_id: Only find posts with a lower ID than this.
+        :type before_id: int
+        """
+        try: limit = int(limit)
+        except: limit = 75
+        if not limit >= 0: limit = 75
+        self.query = str(query)
+        self.limit = limit
+        self.before_id = before_id
+        self.page_size = min(limit, MAX_LIMIT) if limit else MAX_LIMIT
+        self.cursor = not any(t.startswith('order:')
+                              for t in self.query.lower().split())
+
+    @property
+    def requests(self):
+        """Returns the most requests the search will make, or None when
+        fetching all results. Fewer are made if the results run out."""
+        if not self.limit: return None
+        return -(-self.limit // self.page_size)
+
+    def next_request(self, fetched=0, last_id=None):
+        """Returns the next request to make.
+
+        :param fetched: The number of posts received so far.
+        :type fetched: int
+        :param last_id: The ID of the last post received.
+        :type last_id: int
+        :returns: The URL and the number of posts asked for, or None if
+            the limit has been reached.
+        :rtype: tuple
+        """
+        if self.limit and fetched >= self.limit: return None
+        size = self.page_size
+        url = config.BASE_URL + 'post/index.json?tags=' + self.query
+        if self.cursor:
+            if self.limit: size = min(size, self.limit - fetched)
+            before = last_id if fetched else self.before_id
+            if before is not None: url += '&before_id=' + str(before)
+        else:
+            if self.before_id is not None:
+                url += '&before_id=' + str(self.before_id)
+            url += '&page=' + str(fetched // self.page_size + 1)
+        return url + '&limit=' + str(size), size
+
+def normalize_query(query):
+    """Returns a tag query in a canonical form, so queries that differ only
+    in case, spacing or tag order are treated as the same.
+
+    :param query: The tag search query.
+    :type query: str
+    :rtype: str
+    """
+    return ' '.join(sorted(set(str(query).lower().split())))
+
+class SearchCache(object):
+    def __init__(self, path=None, max_age=3600):
+        """Create a cache of search results. Each query's result IDs are
+        kept in order along with the posts' data. Repeating a search only
+        fetches posts newer than the newest cached one, and the full search
+        is rerun once the results are older than `max_age`, to catch posts
+        that were deleted or retagged.
+
+        :param path: A JSON file to load the cache from and save it to.
+            If None, the cache is only kept in memory.
+        :type path: str
+        :param max_age: Seconds before a query is fully searched again.
+            If None, queries are only ever topped up.
+        :type max_age: float
+        """
+        self.path = path
+        self.max_age = max_age
+        self._queries = {}
+        self._posts = {}
+        if path and os.path.isfile(path):
+            with open(path) as f: data = json.load(f)
+            self._queries = data['queries']
+            self._posts = data['posts']
+
+    def __contains__(self, query):
+        return normalize_query(query) in self._queries
+
+    def _store(self, posts):
+        ids = []
+        for p in posts:
+            self._posts[str(p.id)] = dict(p.dump_data())
+            ids.append(p.id)
+        return ids
+
+    def _prune(self):
+        """Forget the data of posts no query refers to any more."""
+        used = set()
+        for entry in self._queries.values():
+            used.update(str(post_id) for post_id in entry['ids'])
+        for post_id in list(self._posts):
+            if post_id not in used: del self._posts[post_id]
+
+    def search(self, query, limit=75):
+        """Returns the results of a search, fetching only what is not
+        cached. Queries with an `order:` or `id:` tag cannot be topped up
+        and are searched in full whenever they are not fresh.
+
+        :param query: The tag search query.
+        :type query: str
+        :param limit: Number of posts to return, 0 for all. Default 75.
+        :type limit: int
+        :returns: The matching posts, in the site's order.
+        :rtype: list
+        """
+        try: limit = int(limit)
+        except: limit = 75
+        if not limit >= 0: limit = 75
+        key = normalize_query(query)
+        entry = self._queries.get(key)
+        now = time.time()
+        incremental = not any(t.startswith(('order:', 'id:'))
+                              for t in key.split())
+        if entry is not None:
+            covered = entry['limit'] == 0 or 0 < limit <= entry['limit']
+            stale = self.max_age is not None and \
+                now - entry['validated'] >= self.max_age
+            if stale or not covered or not incremental or not entry['ids']:
+                entry = None
+            else:
+                newer = self._store(search(
+                    (key + ' id:>' + str(max(entry['ids']))).strip(), 0))
+                seen = set(newer)
+                entry['ids'] = newer + [i for i in entry['ids']
+                                        if i not in seen]
+                if entry['limit']: del entry['ids'][entry['limit']:]
+        if entry is None:
+            entry = {'ids': self._store(search(key, limit)), 'limit': limit,
+                     'validated': now}
+            if limit: del entry['ids'][limit:]
+            self._queries[key] = entry
+            self._prune()
+        ids = entry['ids'][:limit] if limit else entry['ids']
+        return [Post(post_data=dict(self._posts[str(i)])) for i in ids]
+
+    def invalidate(self, query=None):
+        """Drop a query from the cache, so it is searched in full next time.
+
+        :param query: The query to drop. Default all queries.
+        :type query: str
+        """
+        if query is None: self._queries = {}
+        else: self._queries.pop(normalize_query(query), None)
+        self._prune()
+
+    def save(self, path=None):
+        """Write the cache to disk.
+
+        :param path: The file to write. Default is the cache's path.
+        :type path: str
+        """
+        path = path or self.path
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'queries': self._queries, 'posts': self._posts}, f)
+        os.replace(path + '.tmp', path)
 
 def popular_by_day(year=None, month=None, day=None):
     """Get a list of popular posts for a single day.
@@ -104,6 +321,84 @@ def popular_by_month(year=None, month=None):
     for post_data in api._fetch_data(url):
         yield Post(post_data=post_data)
 
+def download_metadata_many(posts, dest, comments=False, pretty=False,
+                           workers=None):
+    """Save the information of many posts locally, fetching the comments of
+    all of them at once.
+
+    :param posts: The posts to save.
+    :type posts: list
+    :param dest: The directory in which metadata will be stored.
+    :type dest: str
+    :param comments: Whether or not the posts' comments should be stored.
+    :type comments: bool
+    :param pretty: Whether or not to pretty print the data to the files.
+    :type pretty: bool
+    :param workers: The most posts whose comments are fetched at once.
+    :type workers: int
+    :returns: A dict of post ID to whether its metadata was saved.
+    :rtype: dict
+    """
+    posts = list(posts)
+    post_comments = comment.for_posts(posts, workers) if comments else {}
+    result = {}
+    for p in posts:
+        # Posts whose comments could not be fetched are not saved.
+        if comments and p.id not in post_comments: result[p.id] = False
+        else: result[p.id] = p.download_metadata(dest, comments, pretty,
+                                                 post_comments.get(p.id))
+    return result
+
+def find_md5s(md5s, workers=None, use_cache=True):
+    """Look up the posts of many files by md5. Up to `MD5_BATCH_SIZE` md5s
+    are searched for in each request, and the requests are made at once.
+    If a batched search fails, each md5 is searched for on its own.
+
+    :param md5s: The md5 hashes to look up.
+    :type md5s: list
+    :param workers: The most requests in flight at once.
+    :type workers: int
+    :param use_cache: Whether to use, and add to, md5s looked up earlier.
+    :type use_cache: bool
+    :returns: A dict of each md5 to its post, or to None if no post has
+        that file.
+    :rtype: dict
+    """
+    result = {}
+    missing = []
+    seen = set()
+    for md5 in md5s:
+        md5 = md5.lower()
+        if md5 in seen: continue
+        seen.add(md5)
+        if use_cache and md5 in _md5_cache:
+            data = _md5_cache[md5]
+            result[md5] = None if data is None else Post(post_data=dict(data))
+        else: missing.append(md5)
+    if not missing: return result
+    def urls(size):
+        for i in range(0, len(missing), size):
+            yield config.BASE_URL + 'post/index.json?tags=md5:' +\
+                ','.join(missing[i:i+size]) + '&limit=' + str(MAX_LIMIT)
+    level = api.get_priority(api.BULK)
+    try: pages = list(api._fetch_many(urls(MD5_BATCH_SIZE), workers, level))
+    except (errors.APIGetError, errors.JSONError):
+        pages = list(api._fetch_many(urls(1), workers, level))
+    found = {}
+    for page in pages:
+        for post_data in page: found[post_data['md5']] = post_data
+    for md5 in missing:
+        data = found.get(md5)
+        if use_cache: _md5_cache[md5] = data
+        result[md5] = None if data is None else Post(post_data=dict(data))
+    return result
+
+def clear_md5_cache():
+    """Forget all md5s looked up by `find_md5s`."""
+    _md5_cache.clear()
+
+_md5_cache = {}
+
 def from_file(dir, filename):
     """Generate a Post object based on locally-stored information for a file.
 
@@ -397,31 +692,75 @@ class Post(object):
 
     @property
     def favorited_users(self):
-        """Returns a generator of users who favorited this post"""
+        """Returns a generator of users who favorited this post. Each user's
+        details are only fetched once they are used; see `user.fetch_many`
+        for loading many at once."""
         url = config.BASE_URL + 'favorite/list_users.json?id=' + str(self.id)
         try: data = api._fetch_data(url)
         except (errors.APIGetError, errors.JSONError): return
         for username in data['favorited_users'].split(','):
-            yield user.User(username)
+            if username: yield user.LazyUser(username)
 
     @property
     def tag_history(self):
-        """Returns a generator of tag changes for this post."""
-        url = config.BASE_URL + 'post_tag_history/index.json?post_id=' +\
-              str(self.id)
-        try: data = api._fetch_data(url)
-        except errors.APIGetError: return
-        for tag_change in data:
-            yield tag_change
+        """Returns a generator of all tag changes for this post."""
+        return self.iter_tag_history()
 
     @property
     def flag_history(self):
-        """Returns a generator of flags for this post."""
+        """Returns a generator of all flags for this post."""
+        return self.iter_flag_history()
+
+    def iter_tag_history(self, since_id=None, prefetch=False):
+        """Returns a generator of tag changes for this post, newest first,
+        fetching further pages as needed.
+
+        :param since_id: Stop at changes with this ID or lower. Save the ID
+            of the first change returned to only get new changes next time.
+        :type since_id: int
+        :param prefetch: Fetch the next page while the current one is used.
+        :type prefetch: bool
+        :returns: A generator of tag change dicts.
+        :rtype: generator object
+        :raises: errors.APIGetError if a page after the first fails to load.
+        """
+        url = config.BASE_URL + 'post_tag_history/index.json?post_id=' +\
+              str(self.id)
+        started = False
+        try:
+            for tag_change in api._fetch_before_id(url, since_id,
+                                                   prefetch=prefetch):
+                started = True
+                yield tag_change
+        except errors.APIGetError:
+            # A post without history fails on its first page; a failure
+            # after that must not pass for the end of the history.
+            if started: raise
+
+    def iter_flag_history(self, since_id=None, prefetch=False):
+        """Returns a generator of flags for this post, newest first,
+        fetching further pages as needed.
+
+        :param since_id: Stop at flags with this ID or lower.
+        :type since_id: int
+        :param prefetch: Fetch the next page while the current one is used.
+        :type prefetch: bool
+        :returns: A generator of flag dicts.
+        :rtype: generator object
+        :raises: errors.APIGetError if a page after the first fails to load.
+        """
         url = config.BASE_URL + 'post_flag_history/index.json?post_id=' +\
               str(self.id)
-        try: data = api._fetch_data(url)
-        except errors.APIGetError: return
-        for flag in data: yield flag
+        started = False
+        try:
+            for flag in api._fetch_before_id(url, since_id,
+                                             prefetch=prefetch):
+                started = True
+                yield flag
+        except errors.APIGetError:
+            # A post without history fails on its first page; a failure
+            # after that must not pass for the end of the history.
+            if started: raise
 
     @property
     def comments(self):
@@ -434,7 +773,7 @@ class Post(object):
             except errors.APIGetError: return
             for comment_data in rs:
                 yield comment.Comment(comment_data=comment_data)
-            if rs is None or len(rs) == 0:
+            if rs is None or len(rs) < comment.COMMENTS_PER_PAGE:
                 end = True
                 break
             page += 1
@@ -472,7 +811,8 @@ class Post(object):
         """
         return self._data
 
-    def download_metadata(self, dest, comments=False, pretty=False):
+    def download_metadata(self, dest, comments=False, pretty=False,
+                          comment_list=None):
         """Save the post's information locally.
 
         :param dest: The directory in which metadata will be stored
@@ -482,6 +822,10 @@ class Post(object):
         :type comments: bool
         :param pretty: Whether or not to pretty print the data to the file.
         :type pretty: bool
+        :param comment_list: Comments already fetched for this post, newest
+            first (as from `comment.for_posts`), to store instead of
+            fetching them again.
+        :type comment_list: list
         :returns: Whether or not the operation was successful.
         :rtype: bool
         """
@@ -490,7 +834,8 @@ class Post(object):
         data = self._data
         data['comments'] = []
         if comments:
-            for c in reversed(list(self.comments)): data['comments'].append(c.dump_data())
+            if comment_list is None: comment_list = list(self.comments)
+            for c in reversed(comment_list): data['comments'].append(c.dump_data())
         try:
             with open(dest + self.md5, 'w') as meta_file:
                 if pretty == True:
@@ -523,8 +868,12 @@ class Post(object):
         filename = name_format % self._data
         if not filename.endswith("." + self.file_ext):
             filename += "." + self.file_ext
-        file = api._get_page(self.file_url)
-        if file and (not os.path.isfile(dest + filename) or overwrite):
+        if os.path.isfile(dest + filename) and not overwrite: return False
+        file = api._get_page(self.file_url, stream=True,
+                             priority=api.get_priority(api.BULK))
+        # Streamed responses hold their connection until closed.
+        with contextlib.closing(file):
+            if not file: return False
             if file.headers['Content-Type'].lower() == 'text/html':
                 raise errors.FileDownloadError('An error occured attempting ' +\
                     'to download the image.')
@@ -534,6 +883,5 @@ class Post(object):
                     if chunk:
                         out_file.write(chunk)
                         out_file.flush()
-            if write_metadata: self.download_metadata(dest + '.metadata/')
-            return True
-        return False
+        if write_metadata: self.download_metadata(dest + '.metadata/')
+        return True
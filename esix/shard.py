@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Crawling large searches with several processes, each searching its own
+range of post IDs.
+"""
+
+import functools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+from . import api, config, post, transport
+
+
+class SharedRateLimiter(object):
+    def __init__(self, max_per_second=None, context=None):
+        """Create a rate limiter whose slots are shared by every process it
+        is passed to, with the same interface as `api.RateLimiter`.
+
+        :param max_per_second: The maximum calls per second, across all
+            processes. Default is the current `config.RATE_LIMIT`.
+        :type max_per_second: float
+        :param context: The multiprocessing context the processes are
+            started from.
+        """
+        if max_per_second is None: max_per_second = config.RATE_LIMIT
+        self.max_per_second = max_per_second
+        self._next_slot = (context or multiprocessing).Value('d', 0.0)
+
+    @property
+    def rate(self):
+        """Returns the maximum calls per second."""
+        return self.max_per_second
+
+    def reserve(self):
+        """Reserve the next free slot.
+
+        :returns: The number of seconds to wait before the slot begins.
+        :rtype: float
+        """
+        if not self.rate: return 0.0
+        with self._next_slot.get_lock():
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + 1.0/float(self.rate)
+        return slot - now
+
+    def wait(self):
+        """Block until the next free slot begins."""
+        delay = self.reserve()
+        if delay > 0: time.sleep(delay)
+
+    def pending(self):
+        """Returns the number of seconds until the next slot is free,
+        without reserving it."""
+        if not self.rate: return 0.0
+        with self._next_slot.get_lock():
+            return max(0.0, self._next_slot.value - time.time())
+
+
+def split_range(low, high, parts):
+    """Split a range of IDs into parts of about equal size.
+
+    :param low: The lowest ID.
+    :type low: int
+    :param high: The highest ID.
+    :type high: int
+    :param parts: The number of parts.
+    :type parts: int
+    :returns: A list of (low, high) tuples, inclusive, highest IDs first.
+    :rtype: list
+    """
+    parts = max(1, min(parts, high - low + 1))
+    size = (high - low + 1) / float(parts)
+    bounds = [low + int(round(size * i)) for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1] - 1) for i in reversed(range(parts))]
+
+def id_bounds(query=''):
+    """Returns the lowest and highest IDs of the posts matching a query.
+
+    :param query: The tag search query.
+    :type query: str
+    :returns: The (low, high) IDs, or None if nothing matches.
+    :rtype: tuple
+    """
+    newest = list(post.search(query, 1))
+    if not newest: return None
+    oldest = list(post.search((query + ' order:id_asc').strip(), 1))
+    return (oldest[0].id, newest[0].id)
+
+def _init_worker(limiter, settings):
+    for name, value in settings.items(): setattr(config, name, value)
+    api._scheduler.limiter = limiter
+    api._get_page.limiter = limiter
+    # Pooled connections must not be shared with the parent process.
+    if isinstance(api._transport, transport.RequestsTransport):
+        api.set_transport(None)
+
+def _range_query(query, id_range):
+    return (query + ' id:' + str(id_range[0]) + '..' +
+            str(id_range[1])).strip()
+
+def _search_range(query, id_range):
+    return [p.dump_data() for p in post.search(_range_query(query, id_range),
+                                               0)]
+
+def _dump_range(query, path, id_range):
+    count = 0
+    with open(path, 'w') as f:
+        for p in post.search(_range_query(query, id_range), 0):
+            f.write(json.dumps(p.dump_data()) + '\n')
+            count += 1
+    return count
+
+def _pool(processes, context):
+    context = context or multiprocessing.get_context()
+    settings = dict((name, getattr(config, name)) for name in dir(config)
+                    if name.isupper())
+    limiter = SharedRateLimiter(context=context)
+    return context.Pool(processes, _init_worker, (limiter, settings))
+
+def _ranges(query, processes, shards, low, high):
+    if low is None or high is None:
+        bounds = id_bounds(query)
+        if bounds is None: return []
+        low = bounds[0] if low is None else low
+        high = bounds[1] if high is None else high
+    return split_range(low, high, shards or processes * 4)
+
+def crawl(query='', processes=None, shards=None, low=None, high=None,
+          context=None):
+    """Search for every post matching a query, with the work split between
+    several processes by post ID. All processes share one rate limit of
+    `config.RATE_LIMIT`. Posts are returned newest first, as from
+    `post.search`.
+
+    :param query: The tag search query. It must not include an `id:` tag.
+    :type query: str
+    :param processes: The number of worker processes. Default is the number
+        of CPUs.
+    :type processes: int
+    :param shards: The number of ID ranges to split the search into. More
+        ranges than processes keeps them all busy when posts are unevenly
+        spread. Default four per process.
+    :type shards: int
+    :param low: The lowest post ID to search. Default is found by searching.
+    :type low: int
+    :param high: The highest post ID to search. Default is found by
+        searching.
+    :type high: int
+    :param context: The multiprocessing context to start workers from.
+    :returns: A generator of the matching posts.
+    :rtype: generator object
+    """
+    processes = processes or os.cpu_count() or 1
+    ranges = _ranges(query, processes, shards, low, high)
+    if not ranges: return
+    with _pool(processes, context) as pool:
+        for rs in pool.imap(functools.partial(_search_range, query), ranges):
+            for data in rs: yield post.Post(post_data=data)
+
+def dump(query, path, processes=None, shards=None, low=None, high=None,
+         context=None):
+    """Save the data of every post matching a query to a file, one JSON
+    object per line, newest first. As with `crawl`, the search is split
+    between several processes, and each writes its posts directly to a
+    part file that is joined in order once done.
+
+    :param query: The tag search query. It must not include an `id:` tag.
+    :type query: str
+    :param path: The file to write.
+    :type path: str
+    :param processes: The number of worker processes. Default is the number
+        of CPUs.
+    :type processes: int
+    :param shards: The number of ID ranges to split the search into.
+    :type shards: int
+    :param low: The lowest post ID to search.
+    :type low: int
+    :param high: The highest post ID to search.
+    :type high: int
+    :param context: The multiprocessing context to start workers from.
+    :returns: The number of posts saved.
+    :rtype: int
+    """
+    processes = processes or os.cpu_count() or 1
+    ranges = _ranges(query, processes, shards, low, high)
+    parts = [path + '.part' + str(i) for i in range(len(ranges))]
+    total = 0
+    try:
+        if ranges:
+            with _pool(processes, context) as pool:
+                total = sum(pool.starmap(
+                    functools.partial(_dump_range, query),
+                    zip(parts, ranges)))
+        with open(path + '.tmp', 'wb') as out:
+            for part in parts:
+                with open(part, 'rb') as f: shutil.copyfileobj(f, out)
+        os.replace(path + '.tmp', path)
+    finally:
+        for part in parts:
+            if os.path.isfile(part): os.remove(part)
+    return total
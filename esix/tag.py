@@ -3,6 +3,9 @@
 Tag class for the e621 API.
 """
 
+import json
+import os
+
 from . import api, config, errors
 
 def all_tags(page=1, limit=2):
@@ -29,6 +32,126 @@ def all_tags(page=1, limit=2):
         page += 1
 
 
+def related(names):
+    """Find the tags related to one or more tags in a single request.
+
+    :param names: A tag name, or a list of tag names.
+    :type names: str or list
+    :returns: A dict of each tag name to a list of (name, count) tuples for
+        its related tags, most related first.
+    :rtype: dict
+    """
+    if isinstance(names, str): names = [names]
+    url = config.BASE_URL + 'tag/related.json?tags=' + ' '.join(names)
+    data = api._fetch_data(url)
+    result = {}
+    for name in names:
+        result[name] = [(t[0], int(t[1])) for t in data.get(name, [])
+                        if t[0] != name]
+    return result
+
+def fetch_many(names, workers=None, store=None):
+    """Load many tags by name at once.
+
+    :param names: The names of the tags to load.
+    :type names: list
+    :param workers: The most requests in flight at once.
+        Default is `config.MAX_WORKERS`.
+    :type workers: int
+    :param store: A local tag store to check first, and to add newly
+        loaded tags to.
+    :type store: tag.TagStore
+    :returns: A dict of tag name to tag. Tags that could not be found or
+        loaded are left out.
+    :rtype: dict
+    """
+    tags = {}
+    missing = []
+    seen = set()
+    for name in names:
+        if name in seen: continue
+        seen.add(name)
+        found = store.get(name) if store is not None else None
+        if found is not None: tags[name] = found
+        else: missing.append(name)
+    urls = [config.BASE_URL + 'tag/index.json?name=' + str(name)
+            for name in missing]
+    for name, tag_list in zip(missing, api._fetch_many(urls, workers,
+                                                       skip_errors=True)):
+        if not tag_list: continue
+        tags[name] = Tag(tag_data=tag_list[0])
+        if store is not None: store.add(tags[name])
+    return tags
+
+
+class TagStore(object):
+    def __init__(self, path=None):
+        """Create a local store of tag data, so tag details such as their
+        type can be looked up without a request.
+
+        :param path: A JSON file to load the store from and save it to.
+            If None, the store is only kept in memory.
+        :type path: str
+        """
+        self.path = path
+        self._tags = {}
+        if path and os.path.isfile(path):
+            with open(path) as f: self._tags = json.load(f)
+
+    def __len__(self):
+        return len(self._tags)
+
+    def __contains__(self, name):
+        return name in self._tags
+
+    def get(self, name):
+        """Returns the stored tag with the given name, or None."""
+        if name not in self._tags: return None
+        return Tag(tag_data=self._tags[name])
+
+    def add(self, tag):
+        """Store a tag, replacing any stored tag with the same name."""
+        self._tags[tag.name] = dict(tag.dump_data())
+
+    def load(self, page=1, limit=None):
+        """Fill the store from the site's list of tags.
+
+        :param page: The page to begin on, 50 tags per page.
+        :type page: int
+        :param limit: The maximum pages of tags to load. Default all.
+        :type limit: int
+        :returns: The number of tags loaded.
+        :rtype: int
+        """
+        count = 0
+        for t in all_tags(page, limit):
+            self.add(t)
+            count += 1
+        return count
+
+    def resolve(self, names, workers=None):
+        """Look up tags by name, fetching only those not stored yet.
+
+        :param names: The names of the tags to look up.
+        :type names: list
+        :param workers: The most requests in flight at once.
+        :type workers: int
+        :returns: A dict of tag name to tag.
+        :rtype: dict
+        """
+        return fetch_many(names, workers, self)
+
+    def save(self, path=None):
+        """Write the store to disk.
+
+        :param path: The file to write. Default is the store's path.
+        :type path: str
+        """
+        path = path or self.path
+        with open(path + '.tmp', 'w') as f: json.dump(self._tags, f)
+        os.replace(path + '.tmp', path)
+
+
 class Tag(object):
     def __init__(self, tag_id=None, tag_data=None):
         """Create an instance of a tag.
@@ -117,10 +240,31 @@ class Tag(object):
 
     @property
     def related(self):
-        """Returns a generator of related tags."""
-        url = config.BASE_URL + 'tag/related.json?tags=' + str(self.name)
-        for tag in api._fetch_data(url)[self.name][1::]:
-            yield Tag(tag[0])
+        """Returns a generator of related tags. Their details are fetched
+        all at once rather than one after another."""
+        return self.get_related()
+
+    @property
+    def related_counts(self):
+        """Returns a list of (name, count) tuples for related tags, without
+        fetching the details of each tag."""
+        return related(self.name)[self.name]
+
+    def get_related(self, workers=None, store=None):
+        """Returns a generator of related tags.
+
+        :param workers: The most requests in flight at once.
+            Default is `config.MAX_WORKERS`.
+        :type workers: int
+        :param store: A local tag store to look tag details up in first.
+        :type store: tag.TagStore
+        :returns: A generator of related tags, most related first.
+        :rtype: generator object
+        """
+        names = [name for name, count in self.related_counts]
+        tags = fetch_many(names, workers, store)
+        for name in names:
+            if name in tags: yield tags[name]
 
     def dump_data(self):
         """Returns a dict of all data stored locally for this object.
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Local index of post tag history, for answering tag questions offline.
+"""
+
+import calendar
+import datetime
+import sqlite3
+import time
+
+from . import post, user
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY, post_id INTEGER NOT NULL,
+    created_at REAL NOT NULL, user_id INTEGER, user TEXT, tags TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_post ON changes (post_id, created_at, id);
+CREATE TABLE IF NOT EXISTS tag_events (
+    tag TEXT NOT NULL, post_id INTEGER NOT NULL, change_id INTEGER NOT NULL,
+    created_at REAL NOT NULL, added INTEGER NOT NULL,
+    user_id INTEGER, user TEXT
+);
+CREATE INDEX IF NOT EXISTS tag_events_tag ON tag_events (tag, created_at);
+CREATE INDEX IF NOT EXISTS tag_events_post ON tag_events (post_id);
+CREATE TABLE IF NOT EXISTS watermarks (
+    source TEXT PRIMARY KEY, change_id INTEGER NOT NULL
+);
+'''
+
+
+def _to_timestamp(value):
+    """Convert a time from the API, a datetime or a number to a Unix
+    timestamp."""
+    if value is None: return 0.0
+    if isinstance(value, dict):
+        return value.get('s', 0) + value.get('n', 0) / 1e9
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None: return value.timestamp()
+        return float(calendar.timegm(value.timetuple())) +\
+            value.microsecond / 1e6
+    if isinstance(value, (int, float)): return float(value)
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try: return float(calendar.timegm(time.strptime(str(value), fmt)))
+        except ValueError: continue
+    raise ValueError('Unrecognised time: ' + str(value))
+
+
+class TagIndex(object):
+    def __init__(self, path=':memory:'):
+        """Create or open a local index of post tag changes. Each post's
+        changes are kept in order, along with which tags each change added
+        or removed.
+
+        :param path: The SQLite database file. Default is in memory.
+        :type path: str
+        """
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ingest(self, changes):
+        """Add tag changes, as returned by `Post.tag_history` or
+        `User.tag_history`. Changes already in the index are skipped.
+
+        :param changes: Tag change dicts, in any order.
+        :type changes: iterable
+        :returns: The number of new changes added.
+        :rtype: int
+        """
+        posts = set()
+        added = 0
+        with self._db:
+            for c in changes:
+                cur = self._db.execute(
+                    'INSERT OR IGNORE INTO changes VALUES (?, ?, ?, ?, ?, ?)',
+                    (c['id'], c['post_id'], _to_timestamp(c.get('created_at')),
+                     c.get('user_id'), c.get('user'), c.get('tags') or ''))
+                if cur.rowcount:
+                    added += 1
+                    posts.add(c['post_id'])
+            for post_id in posts: self._rebuild_events(post_id)
+        return added
+
+    def _rebuild_events(self, post_id):
+        """Recompute which tags each of a post's changes added or removed.
+        The first change known for a post counts as adding all its tags."""
+        self._db.execute('DELETE FROM tag_events WHERE post_id = ?',
+                         (post_id,))
+        previous = set()
+        events = []
+        for change_id, created_at, user_id, username, tags in self._db.execute(
+                'SELECT id, created_at, user_id, user, tags FROM changes '
+                'WHERE post_id = ? ORDER BY created_at, id', (post_id,)):
+            current = set(tags.split())
+            for tag in current - previous:
+                events.append((tag, post_id, change_id, created_at, 1,
+                               user_id, username))
+            for tag in previous - current:
+                events.append((tag, post_id, change_id, created_at, 0,
+                               user_id, username))
+            previous = current
+        self._db.executemany(
+            'INSERT INTO tag_events VALUES (?, ?, ?, ?, ?, ?, ?)', events)
+
+    def _watermark(self, source):
+        row = self._db.execute('SELECT change_id FROM watermarks WHERE '
+                               'source = ?', (source,)).fetchone()
+        return row[0] if row else None
+
+    def _update(self, source, changes):
+        fetched = []
+        try:
+            for c in changes: fetched.append(c)
+        except BaseException:
+            # Keep what was fetched, but leave the watermark so the rest is
+            # fetched next time.
+            self.ingest(fetched)
+            raise
+        changes = fetched
+        count = self.ingest(changes)
+        if changes:
+            newest = max(c['id'] for c in changes)
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO watermarks VALUES '
+                                 '(?, ?)', (source, max(newest,
+                                 self._watermark(source) or 0)))
+        return count
+
+    def update_post(self, post_id, prefetch=False):
+        """Fetch and add a post's tag changes made since its last update.
+
+        :param post_id: The ID number of the post.
+        :type post_id: int
+        :param prefetch: Fetch the next page while the current one is added.
+        :type prefetch: bool
+        :returns: The number of new changes added.
+        :rtype: int
+        :raises: errors.APIGetError if a page fails partway. The changes
+            fetched before it are kept, and the next update fetches the rest.
+        """
+        source = 'post:' + str(post_id)
+        p = post.Post(post_data={'id': post_id})
+        return self._update(source, p.iter_tag_history(
+            self._watermark(source), prefetch))
+
+    def update_user(self, user_id, prefetch=False):
+        """Fetch and add a user's tag changes made since their last update.
+
+        :param user_id: The ID number of the user.
+        :type user_id: int
+        :param prefetch: Fetch the next page while the current one is added.
+        :type prefetch: bool
+        :returns: The number of new changes added.
+        :rtype: int
+        :raises: errors.APIGetError if a page fails partway. The changes
+            fetched before it are kept, and the next update fetches the rest.
+        """
+        source = 'user:' + str(user_id)
+        u = user.User(user_data={'id': user_id})
+        return self._update(source, u.iter_tag_history(
+            self._watermark(source), prefetch))
+
+    def history(self, post_id):
+        """Returns a post's known tag changes, oldest first.
+
+        :param post_id: The ID number of the post.
+        :type post_id: int
+        :returns: A list of dicts with id, created_at (Unix time), user_id,
+            user and tags.
+        :rtype: list
+        """
+        return [{'id': row[0], 'created_at': row[1], 'user_id': row[2],
+                 'user': row[3], 'tags': row[4]}
+                for row in self._db.execute(
+                    'SELECT id, created_at, user_id, user, tags FROM changes '
+                    'WHERE post_id = ? ORDER BY created_at, id', (post_id,))]
+
+    def tags_at(self, post_id, when):
+        """Returns the tags a post had at a point in time.
+
+        :param post_id: The ID number of the post.
+        :type post_id: int
+        :param when: The time, as a Unix timestamp, datetime (UTC if
+            naive) or API time value.
+        :type when: float or datetime.datetime or dict
+        :returns: The set of tags, or None if no change is known that early.
+        :rtype: set
+        """
+        row = self._db.execute(
+            'SELECT tags FROM changes WHERE post_id = ? AND created_at <= ? '
+            'ORDER BY created_at DESC, id DESC LIMIT 1',
+            (post_id, _to_timestamp(when))).fetchone()
+        return set(row[0].split()) if row else None
+
+    def who_added(self, tag, post_id=None):
+        """Returns every time a tag was added, oldest first.
+
+        :param tag: The tag name.
+        :type tag: str
+        :param post_id: Only include additions to this post.
+        :type post_id: int
+        :returns: A list of dicts with post_id, change_id, created_at,
+            user_id and user.
+        :rtype: list
+        """
+        query = 'SELECT post_id, change_id, created_at, user_id, user ' +\
+            'FROM tag_events WHERE tag = ? AND added = 1'
+        params = [tag]
+        if post_id is not None:
+            query += ' AND post_id = ?'
+            params.append(post_id)
+        return [{'post_id': row[0], 'change_id': row[1],
+                 'created_at': row[2], 'user_id': row[3], 'user': row[4]}
+                for row in self._db.execute(query + ' ORDER BY created_at, '
+                                            'change_id', params)]
+
+    def posts_with(self, tag, when):
+        """Returns the IDs of posts that had a tag at a point in time.
+
+        :param tag: The tag name.
+        :type tag: str
+        :param when: The time, as for `tags_at`.
+        :type when: float or datetime.datetime or dict
+        :returns: A sorted list of post IDs.
+        :rtype: list
+        """
+        when = _to_timestamp(when)
+        result = []
+        for post_id, added in self._db.execute(
+                'SELECT post_id, added FROM tag_events e WHERE tag = ? AND '
+                'created_at <= ? AND change_id = (SELECT change_id FROM '
+                'tag_events WHERE tag = e.tag AND post_id = e.post_id AND '
+                'created_at <= ? ORDER BY created_at DESC, change_id DESC '
+                'LIMIT 1)', (tag, when, when)):
+            if added: result.append(post_id)
+        return sorted(result)
@@ -3,7 +3,7 @@
 Ticket class for the e621 API.
 """
 
-from . import api, config, errors
+from . import api, comment, config, errors
 
 def recent(page=1, limit=2):
     """Return a generator of recently created tickets.
@@ -29,6 +29,24 @@ def recent(page=1, limit=2):
         page += 1
 
 
+def reported_comments(tickets, workers=None):
+    """Load the comments reported by many tickets at once.
+
+    :param tickets: The tickets to look up.
+    :type tickets: list
+    :param workers: The most requests in flight at once.
+    :type workers: int
+    :returns: A dict of ticket ID to the reported comment. Tickets that do
+        not report a comment, or whose comment was not found, are left out.
+    :rtype: dict
+    """
+    tickets = [t for t in tickets if t.reported_comment]
+    comments = comment.fetch_many([t.reported_comment for t in tickets],
+                                  workers)
+    return dict((t.id, comments[t.reported_comment]) for t in tickets
+                if t.reported_comment in comments)
+
+
 class Ticket(object):
     def __init__(self, ticket_id=None, ticket_data=None):
         """Create an instance of a ticket.
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Transport layer for the e621 API.
+
+All network I/O made by the library goes through a transport object, which
+can be swapped out with `api.set_transport` (for example to talk to the
+local fake server in `esix.fakeserver` rather than the real site).
+"""
+
+import asyncio
+import functools
+
+
+class Headers(dict):
+    """
+    A dict of HTTP headers with case-insensitive keys.
+    """
+    def __init__(self, data=None, **kwargs):
+        super(Headers, self).__init__()
+        self.update(data or {}, **kwargs)
+
+    def __setitem__(self, key, value):
+        super(Headers, self).__setitem__(key.lower(), value)
+
+    def __getitem__(self, key):
+        return super(Headers, self).__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super(Headers, self).__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super(Headers, self).get(key.lower(), default)
+
+    def update(self, data=None, **kwargs):
+        for key, value in dict(data or {}, **kwargs).items():
+            self[key] = value
+
+
+class Response(object):
+    def __init__(self, url, status_code=200, headers=None, content=b''):
+        """Create a response for a transport that does not use Requests.
+        Mirrors the subset of `requests.Response` used by the library.
+
+        :param url: The URL that was requested.
+        :type url: str
+        :param status_code: The HTTP status code of the response.
+        :type status_code: int
+        :param headers: The response headers.
+        :type headers: dict
+        :param content: The raw response body.
+        :type content: bytes
+        """
+        self.url = url
+        self.status_code = status_code
+        self.headers = Headers(headers)
+        self.content = content
+
+    @property
+    def ok(self):
+        """Returns whether or not the status code is below 400."""
+        return self.status_code < 400
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def text(self):
+        """Returns the response body decoded as UTF-8."""
+        return self.content.decode('utf-8', 'replace')
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        """Returns a generator of chunks of the response body.
+
+        :param chunk_size: The number of bytes per chunk.
+        :type chunk_size: int
+        :param decode_unicode: Whether to yield str rather than bytes.
+        :type decode_unicode: bool
+        :returns: A generator of body chunks.
+        :rtype: generator object
+        """
+        chunk_size = chunk_size or len(self.content) or 1
+        for i in range(0, len(self.content), chunk_size):
+            chunk = self.content[i:i+chunk_size]
+            yield chunk.decode('utf-8', 'replace') if decode_unicode else chunk
+
+    def close(self):
+        pass
+
+
+class Transport(object):
+    """
+    Base class for synchronous transports. Subclasses must implement
+    `get` and `post`, returning a Response-like object.
+    """
+    def get(self, url, headers=None, stream=False):
+        """Fetch the given URL.
+
+        :param url: The URL to fetch.
+        :type url: str
+        :param headers: Extra headers to send with the request.
+        :type headers: dict
+        :param stream: If True, the body may be read lazily through
+            `iter_content` rather than loaded up front.
+        :type stream: bool
+        :returns: The server's response.
+        :rtype: transport.Response or requests.Response
+        """
+        raise NotImplementedError
+
+    def post(self, url, data=None, headers=None):
+        """Post form data to the given URL.
+
+        :param url: The URL to post to.
+        :type url: str
+        :param data: A dict or tuple of tuples with the data to post.
+        :type data: dict or tuple
+        :param headers: Extra headers to send with the request.
+        :type headers: dict
+        :returns: The server's response.
+        :rtype: transport.Response or requests.Response
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the transport."""
+        pass
+
+
+class RequestsTransport(Transport):
+    def __init__(self, session=None):
+        """Create a transport backed by a Requests session, which keeps
+        connections to the site alive between calls.
+
+        :param session: An existing session to use.
+        :type session: requests.Session
+        """
+        import requests
+        self.session = session or requests.Session()
+
+    def get(self, url, headers=None, stream=False):
+        return self.session.get(url, headers=headers, stream=stream)
+
+    def post(self, url, data=None, headers=None):
+        return self.session.post(url, data=data, headers=headers)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncTransport(object):
+    def __init__(self, transport=None, executor=None):
+        """Create an asynchronous transport. By default this runs a
+        synchronous transport in an executor; subclasses may override `get`
+        and `post` with native coroutines.
+
+        :param transport: The synchronous transport to wrap. If None, the
+            transport currently set in `esix.api` is used.
+        :type transport: transport.Transport
+        :param executor: The executor to run requests in. Default is the
+            event loop's default executor.
+        :type executor: concurrent.futures.Executor
+        """
+        self.transport = transport
+        self.executor = executor
+
+    def _sync_transport(self):
+        if self.transport is not None: return self.transport
+        from . import api
+        return api.get_transport()
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor,
+                                    functools.partial(func, *args, **kwargs))
+
+    async def get(self, url, headers=None, stream=False):
+        """Coroutine version of `Transport.get`."""
+        return await self._run(self._sync_transport().get, url,
+                               headers=headers, stream=stream)
+
+    async def post(self, url, data=None, headers=None):
+        """Coroutine version of `Transport.post`."""
+        return await self._run(self._sync_transport().post, url,
+                               data=data, headers=headers)
+
+    async def close(self):
+        pass
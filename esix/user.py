@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Comment class for the e621 API.
+User class for the e621 API.
 """
 
 from . import api, config, errors
@@ -51,6 +51,51 @@ def search(user_id):
     for user_data in api._fetch_data(url):
         yield User(user_data=user_data)
 
+def fetch_many(user_ids, workers=None, use_cache=True):
+    """Load many users by ID or username at once.
+
+    :param user_ids: The ID numbers and/or usernames of the users to load.
+    :type user_ids: list
+    :param workers: The most requests in flight at once.
+        Default is `config.MAX_WORKERS`.
+    :type workers: int
+    :param use_cache: Whether to use, and add to, users loaded earlier.
+    :type use_cache: bool
+    :returns: A dict of each given ID or username to its user. Users that
+        could not be found or loaded are left out.
+    :rtype: dict
+    """
+    users = {}
+    missing = []
+    seen = set()
+    for user_id in user_ids:
+        if user_id in seen: continue
+        seen.add(user_id)
+        if use_cache and str(user_id) in _cache:
+            users[user_id] = User(user_data=_cache[str(user_id)])
+        else: missing.append(user_id)
+    urls = []
+    for user_id in missing:
+        try: int(user_id)
+        except ValueError: id_type = 'name'
+        else: id_type = 'id'
+        urls.append(config.BASE_URL + 'user/index.json?' + id_type + '=' +\
+                    str(user_id))
+    for user_id, user_list in zip(missing, api._fetch_many(urls, workers,
+                                                           skip_errors=True)):
+        if not user_list: continue
+        users[user_id] = User(user_data=user_list[0])
+        if use_cache:
+            _cache[str(user_list[0]['id'])] = user_list[0]
+            _cache[str(user_list[0]['name'])] = user_list[0]
+    return users
+
+def clear_cache():
+    """Forget all users loaded by `fetch_many` and lazy users."""
+    _cache.clear()
+
+_cache = {}
+
 
 class User(object):
     def __init__(self, user_id=None, user_data=None):
@@ -135,19 +180,44 @@ class User(object):
 
     @property
     def tag_history(self):
-        """Returns a generator of tag changes made by the user."""
-        url = config.BASE_URL + 'post_tag_history/index.json?' +\
-              'user_id=' + str(self.id)
-        for tag_change in api._fetch_data(url):
-            yield tag_change
+        """Returns a generator of all tag changes made by the user."""
+        return self.iter_tag_history()
 
     @property
     def flag_history(self):
-        """Returns a generator of post flags made by the user."""
+        """Returns a generator of all post flags made by the user."""
+        return self.iter_flag_history()
+
+    def iter_tag_history(self, since_id=None, prefetch=False):
+        """Returns a generator of tag changes made by the user, newest
+        first, fetching further pages as needed.
+
+        :param since_id: Stop at changes with this ID or lower. Save the ID
+            of the first change returned to only get new changes next time.
+        :type since_id: int
+        :param prefetch: Fetch the next page while the current one is used.
+        :type prefetch: bool
+        :returns: A generator of tag change dicts.
+        :rtype: generator object
+        """
+        url = config.BASE_URL + 'post_tag_history/index.json?' +\
+              'user_id=' + str(self.id)
+        return api._fetch_before_id(url, since_id, prefetch=prefetch)
+
+    def iter_flag_history(self, since_id=None, prefetch=False):
+        """Returns a generator of post flags made by the user, newest
+        first, fetching further pages as needed.
+
+        :param since_id: Stop at flags with this ID or lower.
+        :type since_id: int
+        :param prefetch: Fetch the next page while the current one is used.
+        :type prefetch: bool
+        :returns: A generator of flag dicts.
+        :rtype: generator object
+        """
         url = config.BASE_URL + 'post_flag_history/index.json?' +\
               'user_id=' + str(self.id)
-        for flag in api._fetch_data(url):
-            yield flag
+        return api._fetch_before_id(url, since_id, prefetch=prefetch)
 
     def dump_data(self):
         """Returns a dict of all data stored locally for this object.
@@ -157,3 +227,51 @@ class User(object):
         :rtype: dict
         """
         return self._data
+
+
+class LazyUser(User):
+    def __init__(self, user_id):
+        """Create a handle for a user that is only fetched once any of its
+        details other than the given ID or username are used.
+
+        :param user_id: The user's ID number or username.
+        :type user_id: int or str
+        :raises: errors.UserNotFoundError
+        """
+        self._key = user_id
+        self._loaded = None
+
+    @property
+    def _data(self):
+        if self._loaded is None:
+            users = fetch_many([self._key])
+            if self._key not in users:
+                raise errors.UserNotFoundError('User ' + str(self._key) +\
+                                               ' not found.')
+            self._loaded = users[self._key]._data
+        return self._loaded
+
+    @property
+    def is_loaded(self):
+        """Returns whether the user's details have been fetched."""
+        return self._loaded is not None
+
+    @property
+    def id(self):
+        """Returns the user's ID number."""
+        if self._loaded is None and isinstance(self._key, int):
+            return self._key
+        return self._data['id']
+    @id.setter
+    def id(self, value):
+        self._data['id'] = value
+
+    @property
+    def name(self):
+        """Returns the user's username."""
+        if self._loaded is None and not isinstance(self._key, int):
+            return self._key
+        return self._data['name']
+    @name.setter
+    def name(self, value):
+        self._data['name'] = value
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Incremental polling of the site's recent-item feeds.
+"""
+
+import asyncio
+import json
+import os
+import threading
+
+from . import api, comment, config, forum, pool, post, ticket
+
+
+class Feed(object):
+    def __init__(self, url, wrap, key='id', max_pages=10):
+        """Describe a paged listing of items, newest first.
+
+        :param url: The listing URL, without a page number.
+        :type url: str
+        :param wrap: Function converting raw item data into an object.
+        :type wrap: function
+        :param key: The item field that increases with each new or changed
+            item: 'id', 'change' or 'updated_at'.
+        :type key: str
+        :param max_pages: The most pages fetched back in a single poll.
+        :type max_pages: int
+        """
+        self.url = url
+        self.wrap = wrap
+        self.key = key
+        self.max_pages = max_pages
+
+    def fetch(self, page):
+        """Returns the raw items on a page of the listing."""
+        sep = '&' if '?' in self.url else '?'
+        return api._fetch_data(self.url + sep + 'page=' + str(page))
+
+    def mark(self, item):
+        """Returns the sortable high-water mark value of a raw item."""
+        value = item.get(self.key)
+        if isinstance(value, dict):
+            return [value.get('s', 0), value.get('n', 0)]
+        return value
+
+
+def posts(query='', key='id', limit=100):
+    """Returns a feed of new posts, or with key='change', changed posts.
+
+    :param query: Only watch posts matching this tag query.
+    :type query: str
+    :param key: 'id' for new posts, 'change' for changed posts.
+    :type key: str
+    :param limit: Posts requested per page.
+    :type limit: int
+    :rtype: watch.Feed
+    """
+    if key == 'change': query = (query + ' order:change').strip()
+    return Feed(config.BASE_URL + 'post/index.json?tags=' + query +
+                '&limit=' + str(limit),
+                lambda data: post.Post(post_data=data), key)
+
+def comments():
+    """Returns a feed of new comments.
+
+    :rtype: watch.Feed
+    """
+    return Feed(config.BASE_URL + 'comment/index.json',
+                lambda data: comment.Comment(comment_data=data))
+
+def forum_threads():
+    """Returns a feed of new forum threads.
+
+    :rtype: watch.Feed
+    """
+    return Feed(config.BASE_URL + 'forum/index.json',
+                lambda data: forum.Thread(thread_data=data))
+
+def pools():
+    """Returns a feed of updated pools.
+
+    :rtype: watch.Feed
+    """
+    return Feed(config.BASE_URL + 'pool/index.json',
+                lambda data: pool.Pool(pool_data=data), 'updated_at')
+
+def tickets():
+    """Returns a feed of new tickets.
+
+    :rtype: watch.Feed
+    """
+    return Feed(config.BASE_URL + 'ticket/index.json',
+                lambda data: ticket.Ticket(ticket_data=data))
+
+
+class Watcher(object):
+    def __init__(self, feed, state_path=None, min_interval=10,
+                 max_interval=300, backfill=False):
+        """Create a watcher that polls a feed and delivers only items it
+        has not delivered before, oldest first.
+
+        :param feed: The feed to watch, e.g. `watch.posts()`.
+        :type feed: watch.Feed
+        :param state_path: A JSON file the high-water mark is kept in, so
+            watching can resume after a restart.
+        :type state_path: str
+        :param min_interval: The shortest wait between polls, in seconds.
+        :type min_interval: float
+        :param max_interval: The longest wait between polls, in seconds.
+        :type max_interval: float
+        :param backfill: If True and there is no saved state, the first poll
+            delivers the first page of items. Otherwise it only records
+            where the feed currently is.
+        :type backfill: bool
+        """
+        self.feed = feed
+        self.state_path = state_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.backfill = backfill
+        self.mark = None
+        self._seen = set()
+        self._callbacks = []
+        self._stop = threading.Event()
+        if state_path and os.path.isfile(state_path):
+            with open(state_path) as f: state = json.load(f)
+            self.mark = state['mark']
+            self._seen = set(state['seen'])
+
+    def subscribe(self, callback):
+        """Call a function with each new item.
+
+        :param callback: Function taking the item object.
+        :type callback: function
+        """
+        self._callbacks.append(callback)
+
+    def _save(self):
+        if not self.state_path: return
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump({'mark': self.mark, 'seen': sorted(self._seen)}, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def poll(self):
+        """Fetch everything added since the last poll, paging back as far
+        as needed, and deliver it to subscribers.
+
+        :returns: The new items, oldest first.
+        :rtype: list
+        """
+        first_run = self.mark is None
+        new = {}
+        page = 1
+        while page <= self.feed.max_pages:
+            rs = self.feed.fetch(page)
+            if not rs: break
+            reached = False
+            for item in rs:
+                mark = self.feed.mark(item)
+                if mark is None: continue
+                if not first_run and (mark < self.mark or (mark == self.mark
+                        and item['id'] in self._seen)):
+                    reached = True
+                    continue
+                new[(item['id'], json.dumps(mark))] = (mark, item)
+            if reached or first_run: break
+            page += 1
+        items = sorted(new.values(), key=lambda m: (m[0], m[1]['id']))
+        if items:
+            top = items[-1][0]
+            if self.mark is None or top > self.mark:
+                self.mark, self._seen = top, set()
+            self._seen.update(item['id'] for mark, item in items
+                              if mark == self.mark)
+            self._save()
+        if first_run and not self.backfill: items = []
+        result = [self.feed.wrap(item) for mark, item in items]
+        for obj in result:
+            for callback in self._callbacks: callback(obj)
+        if result: self.interval = max(self.min_interval, self.interval / 2.0)
+        else: self.interval = min(self.max_interval, self.interval * 1.5)
+        return result
+
+    def stop(self):
+        """Stop `run` or iteration after the current poll."""
+        self._stop.set()
+
+    def run(self, max_polls=None):
+        """Poll repeatedly until stopped, waiting longer between polls while
+        nothing new arrives and less while it does.
+
+        :param max_polls: Stop after this many polls. Default never.
+        :type max_polls: int
+        """
+        self._stop.clear()
+        polls = 0
+        while not self._stop.is_set():
+            self.poll()
+            polls += 1
+            if max_polls and polls >= max_polls: break
+            self._stop.wait(self.interval)
+
+    def __iter__(self):
+        self._stop.clear()
+        while not self._stop.is_set():
+            for item in self.poll(): yield item
+            self._stop.wait(self.interval)
+
+    async def __aiter__(self):
+        loop = asyncio.get_event_loop()
+        self._stop.clear()
+        while not self._stop.is_set():
+            for item in await loop.run_in_executor(None, self.poll):
+                yield item
+            await asyncio.sleep(self.interval)
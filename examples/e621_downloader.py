@@ -3,6 +3,7 @@
 import argparse
 import esix
 import hashlib
+import itertools
 import json
 import os
 import shutil
@@ -14,6 +15,9 @@ __UPDATED__ = '2014-07-21'
 
 FILE_MD5_DATA = '.md5data'
 FILE_DOWNLOAD_LOG = 'download-log.txt'
+FILE_CHECKPOINT = '.checkpoint'
+METADATA_BATCH_SIZE = 50
+CHECKPOINT_INTERVAL = 100
 
 
 class ArgumentParserError(Exception): pass
@@ -50,6 +54,9 @@ def get_args():
     parser.add_argument('--copyextras',dest='copy_extras',action='store_true',
                         help='Copy existing files not found in search to '+\
                         'subdirectories. Will not run if --onlynew is set.')
+    parser.add_argument('--resume',action='store_true',
+                        help='Continue an interrupted download of the same '+\
+                        'query from where it stopped.')
     args = vars(parser.parse_args())
     if len(args['query']) != len(args['dest']):
         parser.error('You must specify the same number of queries and '+\
@@ -126,13 +133,14 @@ def main_menu():
                     'store_meta': store_meta,
                     'check_extra': True,
                     'new_only': False,
-                    'copy_extras': False}
+                    'copy_extras': False,
+                    'resume': False}
         elif ans == 0:
             break
         print()
     return {'data':[], 'verify':True, 'enumerate':False,
             'check_extra':True, 'new_only':False,
-            'store_meta':False, 'copy_extras':False}
+            'store_meta':False, 'copy_extras':False, 'resume':False}
 
 def verify(query, dest):
     print('\nDownloading ALL images containing search term(s): '+query)
@@ -172,6 +180,65 @@ def get_md5_list(folder):
         except: data = gen_md5_list(folder)
     return data
 
+def write_md5_list(folder,md5_list):
+    # Written to a temporary file first, so a crash never leaves it broken.
+    with open(folder+FILE_MD5_DATA+'.tmp','wb') as data_file:
+        data_file.write(bytes(json.dumps(md5_list,indent=4,sort_keys=True),
+                              'UTF-8'))
+    os.replace(folder+FILE_MD5_DATA+'.tmp',folder+FILE_MD5_DATA)
+
+def read_checkpoint(folder):
+    # The checkpoint journal holds the query, then one line for each post
+    # finished or failed, in search order. A line cut short by a crash is
+    # ignored.
+    query,records = None,[]
+    if not os.path.isfile(folder+FILE_CHECKPOINT): return query,records
+    with open(folder+FILE_CHECKPOINT) as journal:
+        for line in journal:
+            try: record = json.loads(line)
+            except ValueError: break
+            if 'query' in record: query = record['query']
+            else: records.append(record)
+    return query,records
+
+def write_checkpoint(checkpoint,records):
+    for record in records:
+        checkpoint.write(json.dumps(record)+'\n')
+    checkpoint.flush()
+
+def fail_unstored(records,stored):
+    # Posts whose metadata could not be written are journaled as failed.
+    return [record if record.get('failed') or record['id'] in stored
+            else {'id': record['id'], 'failed': True} for record in records]
+
+def write_metadata_batch(dest,posts,meta_sync):
+    # Returns the IDs of the posts whose metadata is now stored.
+    while True:
+        try:
+            result = meta_sync.write_many(posts,comments=True,pretty=True)
+        except esix.errors.SiteLoadError as err:
+            log_msg(dest,'\tError writing metadata: '+str(err),True)
+            print("\tPlease wait a bit and press [Enter] to try again.")
+            input()
+        except Exception as err:
+            log_msg(dest,'\tError writing metadata: '+str(err),True)
+            return set()
+        else:
+            meta_sync.save()
+            for post in posts:
+                fields = result.get(post.id)
+                if fields is None:
+                    log_msg(dest,'\tMetadata unchanged: '+post.md5)
+                elif fields is False:
+                    log_msg(dest,'\tError writing metadata: '+post.md5)
+                elif fields:
+                    log_msg(dest,'\tUpdated metadata: '+post.md5+' ('+\
+                            ', '.join(fields)+')')
+                else:
+                    log_msg(dest,'\tWrote metadata: '+post.md5)
+            return set(post.id for post in posts
+                       if result.get(post.id) is not False)
+
 def copy_file(src,dest):
     if not os.path.isdir(dest): os.makedirs(dest)
     if not os.path.isfile(src): return
@@ -179,15 +246,25 @@ def copy_file(src,dest):
 
 
 def run(query,dest,do_verify=True,do_enum=False,write_metadata=False,
-        check_extra=True,new_only=False,copy_extras=False):
+        check_extra=True,new_only=False,copy_extras=False,resume=False):
     if dest != "" and not dest.endswith("/"): dest += "/"
     downloaded,failed,extras,notfound = ([] for x in range(4))
     downloaded = 0
+    meta_batch = []
+    if write_metadata:
+        meta_sync = esix.metasync.MetadataSync(dest+'.metadata/')
     if do_verify:
         if not verify(query,dest): return
     folder_md5_list = get_md5_list(dest)
+    # Files finished since the md5 list was last saved are in the journal.
+    journal_query,journal = read_checkpoint(dest)
+    for record in journal:
+        if 'file' in record and os.path.isfile(dest+record['file']):
+            folder_md5_list[record['md5']] = record['file']
+    if journal: write_md5_list(dest,folder_md5_list)
     new_md5_list = folder_md5_list.copy()
     search_md5_list = []
+    resume = resume and journal_query == query and len(journal) > 0
     log = open(dest+FILE_DOWNLOAD_LOG, "w")
     log.close()
     if not do_verify:
@@ -198,29 +275,64 @@ def run(query,dest,do_verify=True,do_enum=False,write_metadata=False,
     log_msg(dest,'Running search...',True)
     # Hack for getting pools - TODO make this better
     check = query.split(':')
-    if len(check) == 2 and check[0].lower() == 'pool':
-        search_result = esix.pool.Pool(check[1]).posts
-        is_pool = True
+    is_pool = len(check) == 2 and check[0].lower() == 'pool'
+    ordered = any(tag.lower().startswith('order:') for tag in query.split())
+    done_ids = set()
+    cursor = None
+    if resume:
+        search_md5_list = [record['md5'] for record in journal
+                           if 'md5' in record]
+        # Failed posts, and posts whose metadata was never written, are
+        # not done.
+        done = [record for record in journal if not record.get('failed') and
+                (not write_metadata or
+                 os.path.isfile(dest+'.metadata/'+record['md5']))]
+        log_msg(dest,'Resuming after '+str(len(done))+' posts.',True)
+        done_ids = set(record['id'] for record in done)
+        # Searches without an order tag are newest first, so the pages
+        # before the first post not done can be skipped.
+        if not is_pool and not do_enum and not ordered:
+            for record in journal:
+                if record['id'] not in done_ids: break
+                cursor = record['id']
+    if is_pool:
+        pool = esix.pool.Pool(check[1])
+        search_result = pool.iter_posts(parallel=True)
     else:
-        search_result = esix.post.search(query,0)
-        is_pool = False
+        search_result = esix.post.search(query,0,before_id=cursor)
     if do_enum:
-        search_result = list(search_result)
-        if is_pool: search_result = list(reversed(search_result))
-        total_imgs = len(search_result)
+        # Posts are numbered oldest first, so the newest post of a search
+        # gets the total count. Counting only up to the newest post found
+        # keeps numbers right if posts are added while downloading. That
+        # bound does not hold for other orders, so those count everything.
+        if is_pool: total_imgs = pool.post_count
+        elif ordered: total_imgs = esix.post.count(query)
+        else:
+            first = next(search_result,None)
+            total_imgs = 0
+            if first is not None:
+                total_imgs = esix.post.count(query+' id:<='+str(first.id))
+                search_result = itertools.chain([first],search_result)
         log_msg(dest,
                 '\n\n'+str(total_imgs)+' images found. Downloading images...',
                 True)
     else:
         log_msg(dest,'\n\nDownloading images...',True)
-        total_imgs = 0
-    for post in search_result:
+        total_imgs = len(done_ids)
+    checkpoint = open(dest+FILE_CHECKPOINT,'a' if resume else 'w')
+    if not resume: checkpoint.write(json.dumps({'query': query})+'\n')
+    # Posts are only journaled once their metadata is written, so a crash
+    # never leaves a finished post without it.
+    pending = []
+    unsynced = 0
+    for position,post in enumerate(search_result):
+        if post.id in done_ids: continue
         log_msg(dest,'Post '+str(post.id))
         file_name = post.md5 + '.' + post.file_ext
         if do_enum:
-            save_name = str(
-                total_imgs-search_result.index(post)
-                ).zfill(len(str(total_imgs)))+' - '+file_name
+            number = position+1 if is_pool else total_imgs-position
+            save_name = str(number).zfill(len(str(total_imgs)))+' - '+\
+                file_name
         else:
             total_imgs += 1
             save_name = file_name
@@ -233,6 +345,7 @@ def run(query,dest,do_verify=True,do_enum=False,write_metadata=False,
                 try: os.rename(dest+existing_file,dest+save_name)
                 except:
                     log_msg(dest,'\tError renaming file',True)
+                else: new_md5_list[post.md5] = save_name
             else:
                 log_msg(dest,'\tFile '+save_name+' already exists.')
                 if new_only:
@@ -257,48 +370,63 @@ def run(query,dest,do_verify=True,do_enum=False,write_metadata=False,
                     downloaded += 1
                     dl_success = True
                     new_md5_list[post.md5] = save_name
+        if post.md5 in new_md5_list:
+            pending.append({'id': post.id, 'md5': post.md5,
+                            'file': new_md5_list[post.md5]})
+        else: pending.append({'id': post.id, 'failed': True})
         if write_metadata:
-            dl_success = False
-            while not dl_success:
-                try:
-                    post.download_metadata(dest + '.metadata/',
-                                           comments=True, pretty=True)
-                except esix.errors.SiteLoadError as err:
-                    log_msg(dest,'\tError writing metadata: '+str(err),True)
-                    print("\tPlease wait a bit and press [Enter] to try again.")
-                    input()
-                except Exception as err:
-                    log_msg(dest,'\tError writing metadata: '+str(err),True)
-                    break
-                else:
-                    log_msg(dest,'\tWrote/Updated metadata: '+post.md5)
-                    dl_success = True
-    if downloaded > 0:
-        with open(dest+FILE_MD5_DATA,'wb') as data_file:
-            data_file.write(bytes(json.dumps(new_md5_list,indent=4,
-                                             sort_keys=True),'UTF-8'))
+            meta_batch.append(post)
+            if len(meta_batch) < METADATA_BATCH_SIZE: continue
+            stored = write_metadata_batch(dest,meta_batch,meta_sync)
+            pending = fail_unstored(pending,stored)
+            meta_batch = []
+        write_checkpoint(checkpoint,pending)
+        unsynced += len(pending)
+        pending = []
+        if unsynced >= CHECKPOINT_INTERVAL:
+            os.fsync(checkpoint.fileno())
+            write_md5_list(dest,new_md5_list)
+            unsynced = 0
+    if meta_batch:
+        stored = write_metadata_batch(dest,meta_batch,meta_sync)
+        pending = fail_unstored(pending,stored)
+    write_checkpoint(checkpoint,pending)
+    if write_metadata: meta_sync.save()
+    checkpoint.close()
+    if new_md5_list != folder_md5_list: write_md5_list(dest,new_md5_list)
+    os.remove(dest+FILE_CHECKPOINT)
 
     log_msg(dest,'Done.',True)
     if check_extra and not new_only:
         log_msg(dest,'\nSearching for extra images...',True)
-        for md5 in folder_md5_list:
-            if md5 not in search_md5_list:
-                img = folder_md5_list[md5]
-                srch = list(esix.post.search('md5:'+md5))
-                if len(srch):
-                    extras.append(img)
-                    log_msg(dest,"File "+img+" found in folder and on site, "+\
-                            "but not in requested search.")
-                    try:
-                        srch[0].download_metadata(dest+'.metadata/',
-                                                  comments=True, pretty=True)
-                    except: pass
-                    if copy_extras: copy_file(dest+img,dest+'!extra/onsite/')
-                else:
-                    notfound.append(img)
-                    log_msg(dest,
-                            "File "+img+" found in folder, but not on site.")
-                    if copy_extras: copy_file(dest+img,dest+'!extra/notfound/')
+        search_md5s = set(search_md5_list)
+        extra_md5s = [md5 for md5 in folder_md5_list if md5 not in search_md5s]
+        while True:
+            try: found = esix.post.find_md5s(extra_md5s)
+            except esix.errors.SiteLoadError as err:
+                log_msg(dest,'\tError searching for extra images: '+str(err),
+                        True)
+                print("\tPlease wait a bit and press [Enter] to try again.")
+                input()
+            else: break
+        onsite = []
+        for md5 in extra_md5s:
+            img = folder_md5_list[md5]
+            if found[md5] is not None:
+                extras.append(img)
+                onsite.append(found[md5])
+                log_msg(dest,"File "+img+" found in folder and on site, "+\
+                        "but not in requested search.")
+                if copy_extras: copy_file(dest+img,dest+'!extra/onsite/')
+            else:
+                notfound.append(img)
+                log_msg(dest,
+                        "File "+img+" found in folder, but not on site.")
+                if copy_extras: copy_file(dest+img,dest+'!extra/notfound/')
+        try:
+            esix.post.download_metadata_many(onsite,dest+'.metadata/',
+                                             comments=True,pretty=True)
+        except: pass
     if not new_only or is_pool:
         log_msg(dest,"\nSuccessfully downloaded "+str(downloaded)+" of "+\
                 str(total_imgs)+" images\n",True)
@@ -326,7 +454,7 @@ if __name__ == '__main__':
         total_downloaded += run(query,dest,args['verify'],
                                 args['enumerate'],args['store_meta'],
                                 args['check_extra'],args['new_only'],
-                                args['copy_extras'])
+                                args['copy_extras'],args['resume'])
     print("Total images downloaded: "+str(total_downloaded)+"\n")
     if args['verify']:
         input('Press ENTER to Exit')
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Share downloads between several machines through a job queue kept on a
+shared drive. Queue the posts of one or more searches once, then start a
+worker on each machine:
+
+    queue_downloader.py /nas/jobs.db add -q "tag1 tag2" -d /nas/tag1
+    queue_downloader.py /nas/jobs.db add -q "pool:1234" -d /nas/pool
+    queue_downloader.py /nas/jobs.db work
+    queue_downloader.py /nas/jobs.db status
+"""
+import argparse
+import esix
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queue',help='The job queue file.')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    add = sub.add_parser('add',help='Queue the posts of searches.')
+    add.add_argument('-q', '--query',action='append',required=True,
+                     help='A search query, or pool:ID for a pool.')
+    add.add_argument('-d', '--dest',action='append',required=True,
+                     help='The destination folder of the previous query.')
+    work = sub.add_parser('work',help='Download queued posts.')
+    work.add_argument('--wait',action='store_true',
+                      help='Keep waiting for new jobs once the queue is empty.')
+    work.add_argument('--batch',type=int,default=10,
+                      help='Jobs leased at once. Default 10.')
+    sub.add_parser('status',help='Show the number of jobs in each state.')
+    sub.add_parser('retry',help='Queue failed jobs again.')
+    args = parser.parse_args()
+    if args.command == 'add' and len(args.query) != len(args.dest):
+        parser.error('You must specify the same number of queries and '+\
+                     'destination directories.')
+    return args
+
+def search(query):
+    check = query.split(':')
+    if len(check) == 2 and check[0].lower() == 'pool':
+        return esix.pool.Pool(check[1]).iter_posts(parallel=True)
+    return esix.post.search(query,0)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    with esix.jobqueue.JobQueue(args.queue) as queue:
+        if args.command == 'add':
+            for query,dest in zip(args.query,args.dest):
+                added = queue.enqueue(search(query),dest)
+                print('Queued '+str(added)+' posts for '+query+' in '+dest)
+        elif args.command == 'work':
+            worker = esix.jobqueue.Worker(queue,batch=args.batch)
+            try: worker.run(wait=args.wait)
+            except KeyboardInterrupt: pass
+            print('Downloaded '+str(worker.downloaded)+', skipped '+\
+                  str(worker.skipped)+', failed '+str(worker.failed)+\
+                  ', lost to other workers '+str(worker.lost))
+        elif args.command == 'retry':
+            print('Queued '+str(queue.retry_failed())+' failed jobs again.')
+        counts = queue.counts()
+        print(', '.join(state+': '+str(counts[state]) for state in
+                        ('ready','leased','done','failed')))
+        for post_id,dest,error in queue.failed():
+            print('\tFailed: post '+str(post_id)+' in '+dest+': '+str(error))
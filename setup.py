@@ -13,5 +13,6 @@ setup(name='esix',
       author=esix.__author__,
       author_email="AMVPh34r@gmail.com",
       install_requires=['requests'],
+      python_requires='>=3.7',
       license='MIT',
       packages=['esix'])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tests for request scheduling in the api module.
+"""
+
+import threading
+import time
+import unittest
+
+from esix import api
+
+
+class _FixedDelayLimiter(api.RateLimiter):
+    """A limiter whose slots always start a fixed time after reserving,
+    as when another process sharing it took the slot just checked."""
+    def __init__(self, delay):
+        api.RateLimiter.__init__(self, 0)
+        self.delay = delay
+
+    def reserve(self):
+        return self.delay
+
+
+class PrioritySchedulerTest(unittest.TestCase):
+    def _run(self, scheduler, arrivals):
+        """Start a waiter for each (priority, delay) in turn and return the
+        priorities in the order they were served."""
+        served = []
+        lock = threading.Lock()
+        def wait(priority):
+            scheduler.wait(priority)
+            with lock: served.append(priority)
+        threads = []
+        for priority, delay in arrivals:
+            time.sleep(delay)
+            thread = threading.Thread(target=wait, args=(priority,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads: thread.join(10)
+        return served
+
+    def test_interactive_served_before_bulk(self):
+        scheduler = api.PriorityScheduler(api.RateLimiter(10))
+        # Take the free slot, so the waiters below queue for the next ones.
+        scheduler.limiter.reserve()
+        served = self._run(scheduler, [(api.BULK, 0), (api.BULK, 0.01),
+                                       (api.INTERACTIVE, 0.01)])
+        self.assertEqual(served, [api.INTERACTIVE, api.BULK, api.BULK])
+        self.assertEqual(scheduler.served[api.BULK], 2)
+        self.assertEqual(scheduler.served[api.INTERACTIVE], 1)
+        self.assertEqual(scheduler.waiting(), {})
+
+    def test_arrival_order_within_class(self):
+        scheduler = api.PriorityScheduler(api.RateLimiter(20))
+        scheduler.limiter.reserve()
+        order = []
+        def wait(name):
+            scheduler.wait(api.BULK)
+            order.append(name)
+        threads = []
+        for name in range(4):
+            threads.append(threading.Thread(target=wait, args=(name,)))
+            threads[-1].start()
+            time.sleep(0.01)
+        for thread in threads: thread.join(10)
+        self.assertEqual(order, [0, 1, 2, 3])
+
+    def test_max_wait_prevents_starvation(self):
+        scheduler = api.PriorityScheduler(api.RateLimiter(10),
+                                          max_wait={api.BULK: 0.05})
+        for i in range(3): scheduler.limiter.reserve()
+        served = self._run(scheduler, [(api.BULK, 0),
+                                       (api.INTERACTIVE, 0.1)])
+        self.assertEqual(served, [api.BULK, api.INTERACTIVE])
+
+    def test_waits_for_reserved_slot(self):
+        scheduler = api.PriorityScheduler(_FixedDelayLimiter(0.2))
+        started = time.time()
+        scheduler.wait()
+        self.assertGreaterEqual(time.time() - started, 0.19)
+
+    def test_priority_context(self):
+        self.assertEqual(api.get_priority(), api.INTERACTIVE)
+        self.assertEqual(api.get_priority(api.BULK), api.BULK)
+        with api.priority(api.BULK):
+            self.assertEqual(api.get_priority(), api.BULK)
+            with api.priority(api.INTERACTIVE):
+                self.assertEqual(api.get_priority(api.BULK), api.INTERACTIVE)
+        self.assertEqual(api.get_priority(), api.INTERACTIVE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Tests for the job queue's lease, acknowledgement and retry rules.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from esix import errors, jobqueue
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = jobqueue.JobQueue(os.path.join(self.dir, 'jobs.db'),
+                                       max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def test_enqueue_skips_duplicates(self):
+        self.assertEqual(self.queue.enqueue([1, 2, 3], 'a'), 3)
+        self.assertEqual(self.queue.enqueue([2, 3, 4], 'a'), 1)
+        self.assertEqual(self.queue.enqueue([1], 'b'), 1)
+        self.assertEqual(self.queue.counts()[jobqueue.READY], 5)
+
+    def test_enqueue_rejects_failed_page(self):
+        with self.assertRaises(errors.PoolError):
+            self.queue.enqueue([1, None, 2], 'a')
+        self.assertEqual(self.queue.counts()[jobqueue.READY], 0)
+
+    def test_lease_hides_jobs(self):
+        self.queue.enqueue([1, 2, 3], 'a')
+        first = self.queue.lease(2)
+        self.assertEqual([job.post_id for job in first], [1, 2])
+        second = self.queue.lease(2)
+        self.assertEqual([job.post_id for job in second], [3])
+        self.assertEqual(self.queue.lease(2), [])
+        self.assertEqual(self.queue.counts()[jobqueue.LEASED], 3)
+
+    def test_ack(self):
+        self.queue.enqueue([1], 'a')
+        job, = self.queue.lease()
+        self.assertTrue(job.ack())
+        self.assertEqual(self.queue.counts()[jobqueue.DONE], 1)
+        self.assertEqual(self.queue.lease(), [])
+        # Settling twice finds no lease.
+        self.assertFalse(job.ack())
+
+    def test_fail_until_out_of_attempts(self):
+        self.queue.enqueue([1], 'a')
+        job, = self.queue.lease()
+        self.assertTrue(job.fail('first'))
+        self.assertEqual(self.queue.counts()[jobqueue.READY], 1)
+        job, = self.queue.lease()
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(job.fail('second'))
+        self.assertEqual(self.queue.counts()[jobqueue.FAILED], 1)
+        self.assertEqual(self.queue.failed(), [(1, 'a/', 'second')])
+        self.assertEqual(self.queue.retry_failed(), 1)
+        job, = self.queue.lease()
+        self.assertEqual(job.attempts, 1)
+
+    def test_expired_lease_is_taken_over(self):
+        self.queue.enqueue([1], 'a')
+        stale, = self.queue.lease(timeout=0)
+        fresh, = self.queue.lease()
+        self.assertNotEqual(stale.lease, fresh.lease)
+        self.assertFalse(stale.ack())
+        self.assertFalse(self.queue.extend(stale))
+        self.assertTrue(fresh.ack())
+        self.assertEqual(self.queue.counts()[jobqueue.DONE], 1)
+
+    def test_expired_out_of_attempts_fails(self):
+        self.queue.enqueue([1], 'a')
+        self.queue.lease(timeout=0)
+        self.queue.lease(timeout=0)
+        self.assertEqual(self.queue.lease(), [])
+        self.assertEqual(self.queue.counts()[jobqueue.FAILED], 1)
+
+    def test_extend_keeps_lease(self):
+        self.queue.enqueue([1], 'a')
+        job, = self.queue.lease(timeout=0)
+        self.assertTrue(self.queue.extend(job))
+        self.assertEqual(self.queue.lease(), [])
+        self.assertTrue(job.ack())
+
+
+class _Worker(jobqueue.Worker):
+    """A worker that runs a callback instead of downloading."""
+    def __init__(self, queue, process, **kwargs):
+        jobqueue.Worker.__init__(self, queue, **kwargs)
+        self._process = process
+
+    def process(self, job):
+        return self._process(job)
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'jobs.db')
+        self.queue = jobqueue.JobQueue(path, max_attempts=3)
+        self.other = jobqueue.JobQueue(path)
+
+    def tearDown(self):
+        self.queue.close()
+        self.other.close()
+        shutil.rmtree(self.dir)
+
+    def test_counts_outcomes(self):
+        self.queue.enqueue([1, 2, 3], 'a')
+        def process(job):
+            if job.post_id == 2: raise errors.FileDownloadError('broken')
+            return job.post_id == 1
+        worker = _Worker(self.queue, process, batch=10)
+        self.assertEqual(worker.run_once(), 3)
+        self.assertEqual((worker.downloaded, worker.skipped, worker.failed,
+                          worker.lost), (1, 1, 1, 0))
+        counts = self.queue.counts()
+        self.assertEqual((counts[jobqueue.DONE], counts[jobqueue.READY]),
+                         (2, 1))
+
+    def test_renews_lease_before_each_job(self):
+        self.queue.visibility_timeout = 0.2
+        self.queue.enqueue([1, 2], 'a')
+        seen = []
+        def process(job):
+            # The second lease would have run out during the first job.
+            if job.post_id == 1: time.sleep(0.3)
+            else: seen.extend(self.other.lease(1))
+            return True
+        worker = _Worker(self.queue, process, batch=2)
+        worker.run_once()
+        self.assertEqual(seen, [])
+        self.assertEqual((worker.downloaded, worker.lost), (2, 0))
+        self.assertEqual(self.queue.counts()[jobqueue.DONE], 2)
+
+    def test_counts_lost_leases(self):
+        self.queue.visibility_timeout = 0
+        self.queue.enqueue([1, 2], 'a')
+        taken = []
+        def process(job):
+            # Another worker takes over the expired lease meanwhile.
+            taken.extend(self.other.lease(1))
+            return True
+        worker = _Worker(self.queue, process, batch=1)
+        worker.run_once()
+        self.assertEqual((worker.downloaded, worker.lost), (0, 1))
+        self.assertEqual(len(taken), 1)
+        self.assertTrue(taken[0].ack())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental JSON array parser.
+"""
+
+import json
+import unittest
+
+from esix import jsonstream
+
+DOCUMENT = json.dumps([
+    {'id': 1, 'tags': 'a b', 'nested': {'list': [1, [2, 3]], 'empty': {}}},
+    {'id': 2, 'body': 'brackets ] } [ { and , commas'},
+    {'id': 3, 'body': 'escaped \\" quote and \\\\ backslash \\u00e9'},
+    'bare string, with ] and "quotes"',
+    12345,
+    -1.5e3,
+    True,
+    None,
+    [],
+    {},
+]).encode('utf-8')
+
+
+def _parse(chunks):
+    parser = jsonstream.ArrayParser()
+    items = []
+    for chunk in chunks: items.extend(parser.feed(chunk))
+    parser.close()
+    return items
+
+
+class ArrayParserTest(unittest.TestCase):
+    def test_whole_document(self):
+        self.assertEqual(_parse([DOCUMENT]), json.loads(DOCUMENT))
+
+    def test_every_split_point(self):
+        expected = json.loads(DOCUMENT)
+        for i in range(len(DOCUMENT) + 1):
+            self.assertEqual(_parse([DOCUMENT[:i], DOCUMENT[i:]]), expected,
+                             'split at byte ' + str(i))
+
+    def test_single_bytes(self):
+        chunks = [DOCUMENT[i:i+1] for i in range(len(DOCUMENT))]
+        self.assertEqual(_parse(chunks), json.loads(DOCUMENT))
+
+    def test_items_returned_as_completed(self):
+        parser = jsonstream.ArrayParser()
+        self.assertEqual(parser.feed(b'[{"id": 1}, {"id"'), [{'id': 1}])
+        self.assertEqual(parser.feed(b': 2}'), [{'id': 2}])
+        self.assertFalse(parser.done)
+        self.assertEqual(parser.feed(b']'), [])
+        self.assertTrue(parser.done)
+
+    def test_whitespace_and_empty(self):
+        self.assertEqual(_parse([b' \n [ ', b'\t] ']), [])
+        self.assertEqual(_parse([b'[ 1 ,', b' 2 ]']), [1, 2])
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            jsonstream.ArrayParser().feed(b'{"id": 1}')
+
+    def test_unterminated(self):
+        parser = jsonstream.ArrayParser()
+        parser.feed(b'[{"id": 1}, ')
+        with self.assertRaises(ValueError): parser.close()
+
+    def test_iter_array(self):
+        chunks = [DOCUMENT[i:i+7] for i in range(0, len(DOCUMENT), 7)]
+        self.assertEqual(list(jsonstream.iter_array(chunks)),
+                         json.loads(DOCUMENT))
+
+
+if __name__ == '__main__':
+    unittest.main()